@@ -47,4 +47,147 @@ class Config():
         """
         return self.config['INFO']['myVERSION']
 
+    def WORKERS(self):
+        """  Returns the number of threads copying small files.
+        """
+        return self.config.get('COPY', {}).get('workers', 4)
+
+    def LARGE_WORKERS(self):
+        """  Returns the number of threads copying large files.
+        """
+        return self.config.get('COPY', {}).get('largeWorkers', 2)
+
+    def LARGE_FILE(self):
+        """  Returns the size in bytes at which a file is copied in the large file lane.
+        """
+        return self.config.get('COPY', {}).get('largeFile', 64*1024*1024)
+
+    def DEVICE_LIMIT(self):
+        """  Returns the default number of copies at once on any one device.
+        """
+        return self.config.get('COPY', {}).get('deviceLimit', 4)
+
+    def DEVICE_LIMITS(self):
+        """  Returns a dictionary of path : limit, the number of copies at once on the device holding path.
+        """
+        return self.config.get('DEVICES', {})
+
+    def DELTA_THRESHOLD(self):
+        """  Returns the size in bytes at which a changed file is delta copied, 0 is off.
+        """
+        return self.config.get('DELTA', {}).get('threshold', 0)
+
+    def DELTA_BLOCK_SIZE(self):
+        """  Returns the block size in bytes used by the delta copy.
+        """
+        return self.config.get('DELTA', {}).get('blockSize', 1024*1024)
+
+    def DELTA_APPEND(self):
+        """  Returns true if the delta copy should use the fast path for files only appended to.
+        """
+        return self.config.get('DELTA', {}).get('appendFastPath', True)
+
+    def HASH_WORKERS(self):
+        """  Returns the number of processes hashing files in checksum mode, 0 is one per CPU.
+        """
+        return self.config.get('HASH', {}).get('workers', 0)
+
+    def HASH_ENTRIES(self):
+        """  Returns the maximum number of entries in the hash cache.
+        """
+        return self.config.get('HASH', {}).get('maxEntries', 5000000)
+
+    def QUEUE_SIZE(self):
+        """  Returns the number of actions that can wait between the scan and the compare.
+        """
+        return self.config.get('PIPELINE', {}).get('queueSize', 10000)
+
+    def MOVE_WINDOW(self):
+        """  Returns the number of new files, and of files to delete, held back to be matched as moves.
+        """
+        return self.config.get('PIPELINE', {}).get('moveWindow', 100000)
+
+    def HASH_BATCH(self):
+        """  Returns the number of files that look the same to hash at a time, in checksum mode.
+        """
+        return self.config.get('PIPELINE', {}).get('hashBatch', 1000)
+
+    def METRICS_FILE(self):
+        """  Returns the file the metrics are written to at the end of a run, None if not written.
+        """
+        return self.config.get('METRICS', {}).get('file', '') or None
+
+    def JOBS(self):
+        """  Returns the list of backup jobs, each a dictionary of name, source, destination and options.
+        """
+        return self.config.get('JOBS', [])
+
+    def IO_BUDGET(self):
+        """  Returns the total number of copy threads over all the jobs running at once.
+        """
+        return self.config.get('SCHEDULER', {}).get('ioBudget', 8)
+
+    def MAX_JOBS(self):
+        """  Returns the largest number of jobs that run at once.
+        """
+        return self.config.get('SCHEDULER', {}).get('maxJobs', 4)
+
+    def KEEP_DAILY(self):
+        """  Returns the number of days the last snapshot of each day is kept for.
+        """
+        return self.config.get('SNAPSHOT', {}).get('keepDaily', 7)
+
+    def KEEP_WEEKLY(self):
+        """  Returns the number of weeks the last snapshot of each week is kept for.
+        """
+        return self.config.get('SNAPSHOT', {}).get('keepWeekly', 4)
+
+    def WATCH_SETTLE(self):
+        """  Returns the seconds without a change before a burst of changes is mirrored, in watch mode.
+        """
+        return self.config.get('WATCH', {}).get('settle', 2)
+
+    def WATCH_MAX_DELAY(self):
+        """  Returns the most seconds a burst of changes is held before it is mirrored, in watch mode.
+        """
+        return self.config.get('WATCH', {}).get('maxDelay', 30)
+
+    def WATCH_RECONCILE(self):
+        """  Returns how often, in seconds, the whole source is compared in watch mode, 0 for never.
+        """
+        return self.config.get('WATCH', {}).get('reconcile', 3600)
+
+    def WATCH_POLL(self):
+        """  Returns how often, in seconds, the whole source is compared if changes can not be watched for.
+        """
+        return self.config.get('WATCH', {}).get('poll', 60)
+
+    def EXCLUDE(self):
+        """  Returns the list of gitignore style patterns of the files and directories left out of the backup.
+        """
+        return self.config.get('FILTER', {}).get('exclude', [])
+
+    def MIN_SIZE(self):
+        """  Returns the size in bytes below which files are left out, 0 is no limit.
+        """
+        return self.config.get('FILTER', {}).get('minSize', 0)
 
+    def MAX_SIZE(self):
+        """  Returns the size in bytes above which files are left out, 0 is no limit.
+        """
+        return self.config.get('FILTER', {}).get('maxSize', 0)
+
+    def MIN_AGE(self):
+        """  Returns the age in days below which files are left out, 0 is no limit.
+        """
+        return self.config.get('FILTER', {}).get('minAge', 0)
+
+    def MAX_AGE(self):
+        """  Returns the age in days above which files are left out, 0 is no limit.
+        """
+        return self.config.get('FILTER', {}).get('maxAge', 0)
+
+    def DELETE_EXCLUDED(self):
+        """  Returns true if what is left out of the backup is deleted from the destination.
+        """
+        return self.config.get('FILTER', {}).get('deleteExcluded', False)
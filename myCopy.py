@@ -0,0 +1,488 @@
+###############################################################################################################
+#                                                                                                             #
+#  A copy executor - runs the file copies on a pool of threads.                                              #
+#                                                                                                             #
+#  The number of copies running at once on each device [keyed on st_dev] can be limited, so a slow NAS or    #
+#  USB drive is not swamped.  Large files are copied in their own lane, so a few multi-GB files do not hold   #
+#  up all the small files behind them.                                                                        #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        executor = myCopy.CopyExecutor(workers=4)
+        executor.submit(sourcePath, destPath, size, copyFunction, ....)
+        errors = executor.shutdown()        # waits for all the copies to finish.
+        executor.cancel()                   # drops the copies not yet started, on Ctrl-C.
+
+    The copy function is called as copyFunction(....) on one of the threads, the paths and size are
+    only used to decide the device and lane.
+
+        backend, written = myCopy.copyFile(sourcePath, destPath, executor.links)
+
+    Copies a file and its metadata, as shutil.copy2, using the fastest method available.
+    Returns the name of the backend used and the number of bytes written.  Sparse files only have their data
+    copied, the holes are left as holes.  A file with several hard links is copied once a run, the other
+    links are linked to that copy.  The copy is written to tempName(destPath) and renamed over destPath once
+    complete, so an interrupted copy never leaves a part written file under the real name.
+"""
+
+import os
+import errno
+import hashlib
+import shutil
+import threading
+import concurrent.futures
+
+try:
+    import fcntl                                    # Not on Windows.
+except ImportError:
+    fcntl = None
+
+FICLONE     = 0x40049409                            # Linux ioctl, from linux/fs.h.
+BUFFER_SIZE = 1024 * 1024                           # Used by the readinto backend.
+TEMP_SUFFIX = ".pyBackup.tmp"                       # A copy being written, renamed once complete.
+
+# If a backend fails with one of these, it is not supported between the two devices - try the next one.
+NOT_SUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+
+class CopyExecutor():
+    """  Runs copies on a pool of threads, with a limit on the number of copies running at once on each device.
+
+         workers      - the number of threads copying small files.
+         largeWorkers - the number of threads copying large files, files of at least largeFile bytes.
+         deviceLimit  - the default number of copies at once on any one device.
+         deviceLimits - a dictionary of path : limit, the limit for the device that path is on.
+         timer        - a myPipeline.StageTimer, if given the copies are timed as busy.
+    """
+
+    def __init__(self, workers=4, largeWorkers=2, largeFile=64*1024*1024, deviceLimit=4, deviceLimits=None, timer=None):
+        self.largeFile    = largeFile
+        self.deviceLimit  = deviceLimit
+        self.smallPool    = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="copy")
+        self.largePool    = concurrent.futures.ThreadPoolExecutor(max_workers=largeWorkers, thread_name_prefix="copyLarge")
+        self.queued       = threading.BoundedSemaphore(workers * 64)    # Stops the small file queue growing without end.
+        self.lock         = threading.Lock()
+        self.devices      = {}                      # directory : st_dev
+        self.semaphores   = {}                      # st_dev : semaphore
+        self.createdDirs  = {}                      # directory : Event, set once it has been made.
+        self.errors       = []
+        self.futures      = set()                   # Copies queued or running.
+        self.links        = HardLinks()               # The source files with several links copied so far.
+        self.cancelled    = False
+        self.timer        = timer
+        if timer:
+            timer.threads = workers + largeWorkers
+            timer.start()
+
+        for path, limit in (deviceLimits or {}).items():
+            try:
+                self.semaphores[os.stat(path).st_dev] = threading.BoundedSemaphore(limit)
+            except OSError:
+                continue                            # Device not mounted.
+
+    def deviceOf(self, path):
+        """  Returns the st_dev of the device that path is on, cached per directory.
+             If the directory does not exist yet, the nearest parent that does is used.
+        """
+        dir = os.path.dirname(path)
+
+        with self.lock:
+            if dir in self.devices:
+                return self.devices[dir]
+
+        parent = dir
+        while True:
+            try:
+                dev = os.stat(parent).st_dev
+                break
+            except OSError:
+                up = os.path.dirname(parent)
+                if up == parent:
+                    dev = 0
+                    break
+                parent = up
+
+        with self.lock:
+            self.devices[dir] = dev
+        return dev
+
+    def semaphore(self, dev):
+        with self.lock:
+            if dev not in self.semaphores:
+                self.semaphores[dev] = threading.BoundedSemaphore(self.deviceLimit)
+            return self.semaphores[dev]
+
+    def makeDirs(self, dir):
+        """  Creates the directory path, if not already created by this executor.
+             Returns true if the directory was created, only one thread will create any directory.
+             The lock is only held to claim the directory, not while it is made [a slow mkdir on a NAS],
+             the other threads wanting the same directory wait for it, the rest carry on.
+        """
+        with self.lock:
+            made  = self.createdDirs.get(dir)
+            claim = made is None
+            if claim:
+                made = self.createdDirs[dir] = threading.Event()
+
+        if not claim:
+            made.wait()
+            with self.lock:
+                failed = dir not in self.createdDirs
+            return self.makeDirs(dir) if failed else False      # Try again, as the thread that failed did.
+
+        try:
+            created = not os.path.isdir(dir)
+            if created:
+                os.makedirs(dir, exist_ok=True)
+        except OSError:
+            with self.lock:
+                del self.createdDirs[dir]
+            raise
+        finally:
+            made.set()
+        return created
+
+    def submit(self, sourcePath, destPath, size, fn, *args):
+        """  Queues a copy, will block if too many small copies are already waiting.
+             Large files are never blocked on, there are few of them and they should start as soon as possible.
+             Once cancelled nothing more is queued.
+        """
+        if self.cancelled:
+            return
+
+        devices = sorted({self.deviceOf(sourcePath), self.deviceOf(destPath)})  # Always acquired in the same order.
+
+        if size >= self.largeFile:
+            future = self.largePool.submit(self._run, devices, fn, *args)
+        else:
+            self.queued.acquire()
+            future = self.smallPool.submit(self._run, devices, fn, *args)
+            future.add_done_callback(lambda f: self.queued.release())
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._done)
+
+    def _run(self, devices, fn, *args):
+        semaphores = [self.semaphore(dev) for dev in devices]
+        for s in semaphores:
+            s.acquire()
+        try:
+            if self.timer:
+                with self.timer.timed():
+                    fn(*args)
+            else:
+                fn(*args)
+        finally:
+            for s in reversed(semaphores):
+                s.release()
+
+    def _done(self, future):
+        with self.lock:
+            self.futures.discard(future)
+            if not future.cancelled() and future.exception() is not None:
+                self.errors.append(future.exception())
+
+    def cancel(self):
+        """  Drops the copies that have not started yet, those running are left to finish.
+        """
+        self.cancelled = True
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+
+    def shutdown(self):
+        """  Waits for all the copies to finish, returns a list of any unexpected exceptions.
+        """
+        self.smallPool.shutdown(wait=True)
+        self.largePool.shutdown(wait=True)
+        if self.timer:
+            self.timer.stop()
+        return self.errors
+
+
+class HardLinks():
+    """  Remembers where each source file with more than one hard link was copied to, this run,
+         so its other links can be linked to the copy, rather than copied again.
+    """
+
+    class Copy():
+        __slots__ = ("destPath", "done", "ok")
+
+        def __init__(self, destPath):
+            self.destPath = destPath
+            self.done     = threading.Event()
+            self.ok       = False
+
+    def __init__(self):
+        self.lock   = threading.Lock()
+        self.copies = {}                            # (st_dev, st_ino) : Copy
+
+    def claim(self, key, destPath):
+        """  Returns None if this is the first link of key to be copied - call done() once copied.
+             Otherwise returns the first link's Copy, to link to.
+        """
+        with self.lock:
+            copy = self.copies.get(key)
+            if copy is None:
+                self.copies[key] = HardLinks.Copy(destPath)
+            return copy
+
+    def done(self, key, ok):
+        copy    = self.copies[key]
+        copy.ok = ok
+        copy.done.set()
+
+    def link(self, copy, destPath):
+        """  Waits for the first link to be copied, then links destPath to it.
+             Returns false if the first copy failed, or the link can not be made [another device], so copy instead.
+        """
+        copy.done.wait()
+        if not copy.ok:
+            return False
+
+        tmpPath = tempName(destPath)                # So an existing file is replaced in one go.
+        _removeTemp(tmpPath)                        # Left by an interrupted run.
+        try:
+            os.link(copy.destPath, tmpPath)
+            os.replace(tmpPath, destPath)
+            return True
+        except OSError:
+            _removeTemp(tmpPath)
+            return False
+
+
+def tempName(destPath):
+    """  Returns the name destPath is written under while being copied, a hidden file in the same directory.
+         A long name is replaced by its hash, so the temporary name is not too long for the file system.
+    """
+    dir, name = os.path.split(destPath)
+    if len(name) > 200:
+        name = hashlib.md5(os.fsencode(name)).hexdigest()
+    return os.path.join(dir, f".{name}{TEMP_SUFFIX}")
+
+
+_unsupported = set()                                # (backend, source st_dev, dest st_dev) that have failed.
+_buffers     = threading.local()                    # Each copy thread reuses its own buffer.
+
+
+def copyFile(sourcePath, destPath, links=None):
+    """  Copies sourcePath to destPath and the file metadata, as shutil.copy2.
+
+         On Linux the backends are tried in order, reflink [a copy on write clone], copy_file_range,
+         sendfile then a readinto loop.  A backend that is not supported between two devices is not
+         tried again for them.  Elsewhere shutil.copy2 is used.
+
+         A sparse file [less space allocated than its size] only has its data copied, found with
+         SEEK_DATA and SEEK_HOLE, otherwise the destination space is preallocated.  The page cache is
+         told the source is read sequentially and that neither file is needed afterwards, so a backup
+         does not evict the cache.
+
+         If links [a HardLinks] is given, a source file with several hard links is only copied once,
+         its other links are linked to that copy.
+
+         The copy, data and metadata, is written to tempName(destPath) then renamed over destPath, so destPath
+         is either the old file or the complete new one, never part written.  As the old file is replaced
+         rather than written over, any other hard links to it keep their contents.
+
+         Returns the name of the backend that copied the data, and the number of bytes written.
+    """
+    tmpPath = tempName(destPath)
+    if fcntl is None or not hasattr(os, "copy_file_range"):
+        try:
+            shutil.copy2(sourcePath, tmpPath)
+            os.replace(tmpPath, destPath)
+        except BaseException:
+            _removeTemp(tmpPath)
+            raise
+        return "copy2", os.path.getsize(destPath)
+
+    claimed = None
+    with open(sourcePath, "rb") as fsrc:
+        source = fsrc.fileno()
+        st     = os.fstat(source)
+
+        if links is not None and st.st_nlink > 1:
+            key   = (st.st_dev, st.st_ino)
+            first = links.claim(key, destPath)
+            if first is None:
+                claimed = key
+            elif links.link(first, destPath):
+                return "hardlink", 0
+
+        try:
+            with open(tmpPath, "wb") as fdst:
+                dest = fdst.fileno()
+                devs = (st.st_dev, os.fstat(dest).st_dev)
+
+                backend = reflink(source, dest, devs)
+                written = 0 if backend else st.st_size
+                if backend is None:
+                    _advise(source, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    if isSparse(st):
+                        backend, written, offset = copySparse(source, dest, st.st_size, devs)
+                    else:
+                        if st.st_size:
+                            try:
+                                os.posix_fallocate(dest, 0, st.st_size)
+                            except OSError:
+                                pass                # Not supported by the file system, not a problem.
+                        backend, offset = copyData(source, dest, st.st_size, devs)
+                    if offset != st.st_size:        # Source has changed size while being copied.
+                        os.ftruncate(dest, offset)
+
+                    _advise(source, 0, 0, os.POSIX_FADV_DONTNEED)
+                    _advise(dest, 0, 0, os.POSIX_FADV_DONTNEED)
+
+            shutil.copystat(sourcePath, tmpPath)
+            os.replace(tmpPath, destPath)
+        except BaseException:
+            _removeTemp(tmpPath)
+            if claimed:
+                links.done(claimed, False)          # The other links will copy instead.
+            raise
+
+    if claimed:
+        links.done(claimed, True)
+    return backend, written
+
+
+def _removeTemp(tmpPath):
+    try:
+        os.remove(tmpPath)
+    except OSError:
+        pass                                        # Never created, or can not be removed - the journal tries again.
+
+
+def isSparse(st):
+    """  Returns true if the file has holes, less space is allocated than its size.
+    """
+    return hasattr(os, "SEEK_DATA") and st.st_size > 0 and st.st_blocks * 512 < st.st_size
+
+
+def copySparse(source, dest, size, devs):
+    """  Copies just the data of a sparse file, found with SEEK_DATA and SEEK_HOLE, the holes are left as holes.
+         Returns the name of the last backend used, the bytes written and the size copied.
+    """
+    backend = "sparse"
+    written = 0
+    offset  = 0
+    while offset < size:
+        try:
+            start = os.lseek(source, offset, os.SEEK_DATA)
+        except OSError as error:
+            if error.errno != errno.ENXIO:          # No more data, the rest is a hole.
+                raise
+            break
+        end            = min(os.lseek(source, start, os.SEEK_HOLE), size)
+        backend, done  = copyData(source, dest, end, devs, start)
+        written       += done - start
+        offset         = end
+        if done < end:                              # Source has shrunk while being copied.
+            return f"sparse {backend}", written, done
+
+    os.ftruncate(dest, size)                        # Any hole at the end.
+    return f"sparse {backend}" if written else backend, written, size
+
+
+def reflink(source, dest, devs):
+    """  Clones the source into dest, only works on copy on write file systems [btrfs, xfs].
+         Returns "reflink" if the file was cloned, otherwise None.
+    """
+    if ("reflink", *devs) in _unsupported:
+        return None
+
+    try:
+        fcntl.ioctl(dest, FICLONE, source)
+        return "reflink"
+    except OSError as error:
+        if error.errno not in NOT_SUPPORTED:
+            raise
+        _unsupported.add(("reflink", *devs))
+        return None
+
+
+def copyData(source, dest, size, devs, offset=0):
+    """  Copies source to dest, from offset up to size, trying copy_file_range, then sendfile, then a
+         readinto loop.  If a backend stops part way, the next backend carries on from where it stopped.
+         Returns the name of the last backend used and the offset copied up to.
+    """
+    for backend, fn in (("copy_file_range", _copyFileRange), ("sendfile", _sendFile)):
+        if (backend, *devs) in _unsupported:
+            continue
+        try:
+            offset = fn(source, dest, offset, size)
+        except OSError as error:
+            if error.errno not in NOT_SUPPORTED:
+                raise
+            _unsupported.add((backend, *devs))
+            continue
+        if offset >= size:
+            return backend, offset
+
+    return "readinto", _readInto(source, dest, offset, size)
+
+
+def _copyFileRange(source, dest, offset, size):
+    while offset < size:
+        copied = os.copy_file_range(source, dest, size - offset, offset, offset)
+        if copied == 0:                             # End of file, or not able to copy this file.
+            break
+        offset += copied
+    return offset
+
+
+def _sendFile(source, dest, offset, size):
+    os.lseek(dest, offset, os.SEEK_SET)
+    while offset < size:
+        sent = os.sendfile(dest, source, offset, min(size - offset, 0x7ffff000))
+        if sent == 0:
+            break
+        offset += sent
+    return offset
+
+
+def _readInto(source, dest, offset, end):
+    """  Copies from offset up to end, using one reused buffer per thread.
+    """
+    if not hasattr(_buffers, "view"):
+        _buffers.view = memoryview(bytearray(BUFFER_SIZE))
+    view = _buffers.view
+
+    os.lseek(source, offset, os.SEEK_SET)
+    os.lseek(dest, offset, os.SEEK_SET)
+    while offset < end:
+        read = os.readv(source, [view[:end - offset]])
+        if read == 0:
+            return offset
+        written = 0
+        while written < read:
+            written += os.write(dest, view[written:read])
+        offset += read
+    return offset
+
+
+def _advise(fd, offset, length, advice):
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
@@ -0,0 +1,156 @@
+###############################################################################################################
+#                                                                                                             #
+#  A deletion queue - deletes files and whole directory trees on a background thread.                        #
+#                                                                                                             #
+#  A directory tree that is not in the source is removed in one go, one rmtree or one move to the recycle    #
+#  bin, rather than file by file.  The remaining files to be moved to the recycle bin are sent in batches.   #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        deleter = myDelete.DeleteQueue(zap, onDone)
+        deleter.deleteFile(path, item)
+        deleter.deleteTree(path, item)
+        deleter.close()                     # waits for all the deletes to finish.
+        deleter.cancel()                    # drops the deletes not yet started, on Ctrl-C.
+
+    onDone(item, error) is called on the background thread once item has been deleted, error is None
+    if it went well.  Any exception is passed to onDone as the error, the thread carries on.
+    Needs send2trash 1.8 or later, which takes a list of files.
+"""
+
+import os
+import queue
+import shutil
+import threading
+import contextlib
+from send2trash import send2trash
+
+_STOP = object()
+
+
+class DeleteQueue():
+    """  Deletes files and trees on a background thread, so the caller is not held up.
+
+         If zap is true files are removed, otherwise they are moved to the recycle bin, batchSize
+         files at a time.  The queue holds at most maxQueued items, put will wait if it is full.
+         If a myPipeline.StageTimer is given, the deletes are timed as busy.
+    """
+
+    def __init__(self, zap, onDone, batchSize=100, maxQueued=10000, timer=None):
+        self.zap       = zap
+        self.onDone    = onDone
+        self.batchSize = batchSize
+        self.queue     = queue.Queue(maxQueued)
+        self.cancelled = False
+        self.timer     = timer
+        if timer:
+            timer.start()
+        self.thread    = threading.Thread(target=self._run, name="delete", daemon=True)
+        self.thread.start()
+
+    def deleteFile(self, path, item):
+        if not self.cancelled:
+            self.queue.put((False, path, item))
+
+    def deleteTree(self, path, item):
+        if not self.cancelled:
+            self.queue.put((True, path, item))
+
+    def cancel(self):
+        """  Drops the deletes still in the queue.
+        """
+        self.cancelled = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def close(self):
+        """  Waits for all the queued deletes to finish.
+        """
+        self.queue.put(_STOP)
+        self.thread.join()
+        if self.timer:
+            self.timer.stop()
+
+    def _run(self):
+        batch = []                                  # Files waiting to go to the recycle bin.
+
+        while True:
+            entry = self.queue.get()
+            if entry is _STOP:
+                break
+            if self.cancelled:
+                continue
+
+            isTree, path, item = entry
+            try:
+                if self.zap:
+                    self._delete(shutil.rmtree if isTree else os.remove, path, item)
+                elif isTree:
+                    self._trash(batch)              # Keep the deletes in order.
+                    batch = []
+                    self._delete(send2trash, path, item)
+                else:
+                    batch.append((path, item))
+                    if len(batch) >= self.batchSize or self.queue.empty():
+                        self._trash(batch)
+                        batch = []
+            except Exception as error:              # Never let the thread die, close() would wait for ever.
+                batch = []
+                with contextlib.suppress(Exception):
+                    self.onDone(item, error)
+
+        with contextlib.suppress(Exception):
+            self._trash(batch)
+
+    def _timed(self):
+        return self.timer.timed() if self.timer else contextlib.nullcontext()
+
+    def _delete(self, fn, path, item):
+        try:
+            with self._timed():
+                fn(path)
+        except Exception as error:
+            self.onDone(item, error)
+        else:
+            self.onDone(item, None)
+
+    def _trash(self, batch):
+        """  Moves a batch of files to the recycle bin, in one call.
+        """
+        if not batch:
+            return
+
+        try:
+            with self._timed():
+                send2trash([path for path, _ in batch])
+        except Exception:                           # Find out which file[s] failed.
+            for path, item in batch:
+                if os.path.lexists(path):
+                    self._delete(send2trash, path, item)
+                else:
+                    self.onDone(item, None)
+            return
+
+        for _, item in batch:
+            self.onDone(item, None)
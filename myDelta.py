@@ -0,0 +1,104 @@
+###############################################################################################################
+#                                                                                                             #
+#  Block level delta copy - only rewrites the parts of a large file that have changed.                       #
+#                                                                                                             #
+#  The source and the existing destination are read a block at a time and compared, only blocks that        #
+#  differ are written, in place, to the destination.  Files that have only been appended to [logs] can       #
+#  take a fast path, where only the new tail is copied.                                                       #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        written = myDelta.deltaCopy(sourcePath, destPath)
+
+    Returns the number of bytes actually written to the destination.
+
+    Both files are local, so the blocks are compared directly, rather than by a hash or rolling checksum
+    as rsync does over a network - the hash would cost more than the compare and save no reads.
+"""
+
+import os
+import shutil
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def deltaCopy(sourcePath, destPath, blockSize=BLOCK_SIZE, appendFastPath=True):
+    """  Makes destPath the same as sourcePath, writing only the blocks that differ.
+         The file metadata is copied afterwards, as shutil.copy2.
+
+         If appendFastPath is true and the source is larger than the destination, the first and last blocks
+         of the destination are checked against the source, if the same the file is taken as only
+         appended to and just the new tail is copied.  Don't use on files that are changed in the middle
+         and also grow.
+
+         Returns the number of bytes written.
+    """
+    written = 0
+
+    with open(sourcePath, "rb", buffering=0) as fsrc, open(destPath, "r+b", buffering=0) as fdst:
+        sourceSize = os.fstat(fsrc.fileno()).st_size
+        destSize   = os.fstat(fdst.fileno()).st_size
+        sView      = memoryview(bytearray(blockSize))
+        dView      = memoryview(bytearray(blockSize))
+
+        offset = 0
+        if appendFastPath and sourceSize > destSize and isAppended(fsrc, fdst, destSize, sView, dView):
+            offset = destSize
+
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        while True:
+            read = fsrc.readinto(sView)
+            if not read:
+                break
+
+            same = False
+            if offset < destSize:
+                same = fdst.readinto(dView[:read]) == read and sView[:read] == dView[:read]
+
+            if not same:
+                fdst.seek(offset)
+                fdst.write(sView[:read])
+                written += read
+            offset += read
+
+        fdst.truncate(offset)                       # Source may be smaller than the old destination.
+
+    shutil.copystat(sourcePath, destPath)
+    return written
+
+
+def isAppended(fsrc, fdst, destSize, sView, dView):
+    """  Returns true if the first and last blocks of the destination match the source,
+         i.e. the source looks to have only been appended to.
+    """
+    blockSize = len(sView)
+
+    for offset in sorted({0, max(destSize - blockSize, 0)}):
+        length = min(blockSize, destSize - offset)
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        if fsrc.readinto(sView[:length]) != length or fdst.readinto(dView[:length]) != length:
+            return False
+        if sView[:length] != dView[:length]:
+            return False
+
+    return True
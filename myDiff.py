@@ -0,0 +1,391 @@
+###############################################################################################################
+#                                                                                                             #
+#  The diff engine - compares a source directory tree against a destination directory tree.                  #
+#                                                                                                             #
+#  Each tree is walked once using os.scandir, the cached DirEntry.stat() values are used so each file is      #
+#  only stat'ed once.  The sorted listings of each directory are merge joined and a stream of actions is      #
+#  produced, copy, update, delete and empty directory, which are then consumed by pyBackup.py.               #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        for action in myDiff.diffTrees(sourceDir, destDir):
+            if action.mode == myDiff.COPY:
+                ....
+
+    The action modes are also the text that is printed for each file.
+"""
+
+import os
+import time
+import array
+import pathlib
+import myMetrics
+
+COPY      = "file does not exist in destination."
+SIZE      = "file size has changed."
+DATE      = "file date has changed."
+HASH      = "file contents have changed."
+SAME      = "file is unchanged."
+MOVE      = "file has been moved."
+DIRMOVE   = "directory has been moved."
+DELETE    = "file does not exist in Source"
+EMPTYDIR  = "empty directory"
+ERROR     = "could not scan directory"
+LINK      = "file is unchanged since the last snapshot."
+SCANNED   = "directory has been scanned"
+
+FORWARD   = (COPY, SIZE, DATE, HASH)        # The modes consumed by the forward phase.
+
+
+class Listing:
+    """  A directory listing, held as columns rather than an object for each entry.
+
+         Holds the values from the cached DirEntry.stat(), so the file is not stat'ed again.  names and keys are
+         lists, isDir a bytearray, size, mtime and inode arrays - about 100 bytes a file with its name, against
+         200 or so for an object with a float and an int for each file.  Entry i is names[i], isDir[i] and so on.
+    """
+    __slots__ = ("names", "keys", "isDir", "size", "mtime", "inode")
+
+    def __init__(self):
+        self.names = []
+        self.keys  = []                         # Windows is case insensitive, so compare on the normalised name.
+        self.isDir = bytearray()                # On posix the key is the name, so not held twice.
+        self.size  = array.array("q")
+        self.mtime = array.array("d")
+        self.inode = array.array("Q")
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, isDir, size=0, mtime=0, inode=0):
+        self.names.append(name)
+        self.keys.append(os.path.normcase(name))
+        self.isDir.append(isDir)
+        self.size.append(size)
+        self.mtime.append(mtime)
+        self.inode.append(inode)
+
+    def select(self, indices):
+        """  Returns a new Listing of the entries at indices, in that order.
+        """
+        listing = Listing()
+        listing.names = [self.names[i] for i in indices]
+        listing.keys  = [self.keys[i] for i in indices]
+        listing.isDir = bytearray(self.isDir[i] for i in indices)
+        listing.size  = array.array("q", [self.size[i] for i in indices])
+        listing.mtime = array.array("d", [self.mtime[i] for i in indices])
+        listing.inode = array.array("Q", [self.inode[i] for i in indices])
+        return listing
+
+    def sorted(self):
+        """  Returns the listing sorted on the key, itself if already sorted [as a manifest listing may be].
+        """
+        keys  = self.keys
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        if all(i == n for n, i in enumerate(order)):
+            return self
+        return self.select(order)
+
+
+class Action:
+    """  A single thing to be done to the destination.
+
+         size and mtime are from the file that justified the action, the source file for a
+         copy or update, the destination file for a delete.
+         movedFrom and moves are only used by moves, see myMove.py.
+    """
+    __slots__ = ("mode", "sourcePath", "destPath", "size", "mtime", "error", "movedFrom", "moves")
+
+    def __init__(self, mode, sourcePath, destPath, size=0, mtime=0, error=None):
+        self.mode       = mode
+        self.sourcePath = sourcePath
+        self.destPath   = destPath
+        self.size       = size
+        self.mtime      = mtime
+        self.error      = error
+        self.movedFrom  = None
+        self.moves      = None
+
+    def __repr__(self):
+        return f"Action({self.mode!r}, {self.sourcePath!r}, {self.destPath!r}, {self.size}, {self.mtime})"
+
+
+def mirrorRoot(sourceDir, destDir):
+    """  Returns the directory in the destination that mirrors the source directory.
+
+         The source path is appended to the destination, less any drive or root,
+         so d:\\music backed up to e:\\backup is mirrored in e:\\backup\\music.
+    """
+    sourceDir = pathlib.Path(sourceDir)
+    parts     = sourceDir.parts[1:] if sourceDir.anchor else sourceDir.parts
+
+    return pathlib.Path(destDir).joinpath(*parts)
+
+
+_statSeconds = myMetrics.METRICS.histogram("stat_seconds", "Time to stat a file while scanning.")
+_listSeconds = myMetrics.METRICS.histogram("list_dir_seconds", "Time to list a directory, including the stats.")
+_skipped     = myMetrics.METRICS.counter("skipped_dirs_total", "Directories not scanned, completed by the run being resumed.")
+_scanFiles   = myMetrics.METRICS.counter("scanned_files_total", "Files in the source.")
+_scanBytes   = myMetrics.METRICS.counter("scanned_bytes_total", "Bytes in the files in the source.")
+_excluded    = {isDir: myMetrics.METRICS.counter("excluded_total", "Entries in the source left out by the filters.",
+                                                 kind="dir" if isDir else "file") for isDir in (True, False)}
+
+
+def listDir(path, filter=None):
+    """  Returns the sorted Listing of path, using os.scandir.
+
+         Directories that are symbolic links are not followed [as glob did], symbolic links
+         to files are followed, anything else [sockets etc] is ignored.
+         If a myFilter.Filter is given, the entries it leaves out are dropped - a file before it is stat'ed.
+    """
+    entries   = Listing()
+    add       = entries.add
+    statTimes = []
+    clock     = time.perf_counter
+    start     = clock()
+    prefix    = None
+    if filter is not None:
+        prefix = filter.relative(os.fspath(path))
+        prefix = prefix + "/" if prefix else ""
+
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if prefix is not None and filter.excluded(prefix + entry.name, True, entry.name):
+                        _excluded[True].inc()
+                        continue
+                    add(entry.name, True)
+                elif entry.is_file():
+                    if prefix is not None and filter.excluded(prefix + entry.name, False, entry.name):
+                        _excluded[False].inc()
+                        continue
+                    statStart = clock()
+                    st = entry.stat()
+                    statTimes.append(clock() - statStart)
+                    if prefix is not None and filter.hasLimits and filter.outOfLimits(st.st_size, st.st_mtime):
+                        _excluded[False].inc()
+                        continue
+                    add(entry.name, False, st.st_size, st.st_mtime, st.st_ino)
+            except OSError:                         # File has vanished since the directory was read.
+                continue
+
+    entries = entries.sorted()
+    _statSeconds.observeMany(statTimes)             # Once per directory, keeps the lock out of the loop.
+    _listSeconds.observe(clock() - start)
+    return entries
+
+
+def mergeJoin(sourceKeys, destKeys):
+    """  Merge joins the keys of two sorted directory listings.
+
+         Yields a pair of indices (s, d) for each name, either can be None if
+         the name is only on one side.
+    """
+    s, d = 0, 0
+    sLen, dLen = len(sourceKeys), len(destKeys)
+
+    while s < sLen and d < dLen:
+        sKey, dKey = sourceKeys[s], destKeys[d]
+        if sKey == dKey:
+            yield s, d
+            s += 1
+            d += 1
+        elif sKey < dKey:
+            yield s, None
+            s += 1
+        else:
+            yield None, d
+            d += 1
+
+    for s in range(s, sLen):
+        yield s, None
+    for d in range(d, dLen):
+        yield None, d
+
+
+class Frame:
+    """  The state of one destination directory during the walk, used to find the directories that will
+         be empty once this run's deletes are done.
+
+         kept is the number of files that will be left in the directory, pending the number of
+         sub directories not yet finished, emptyDirs the sub directories that will be empty, with the
+         number of directories in each.
+
+         A frame waiting to be walked only holds its names, the same strings as in its parent's listing.
+         The full paths are only made once it is walked, so a directory of a million sub directories
+         does not hold a million pairs of paths.  The root frame's names are the full paths.
+    """
+    __slots__ = ("sourceName", "destName", "sourceDir", "destDir", "inSource", "inDest", "parent", "kept",
+                 "pending", "emptyDirs", "walked")
+
+    def __init__(self, sourceName, destName, inSource, inDest, parent):
+        self.sourceName = sourceName
+        self.destName   = destName
+        self.sourceDir  = None if parent else sourceName
+        self.destDir    = None if parent else destName
+        self.inSource   = inSource
+        self.inDest     = inDest
+        self.parent     = parent
+        self.kept      = 0
+        self.pending   = 0
+        self.emptyDirs = []
+        self.walked    = False
+
+
+def diffTrees(sourceDir, destDir, destLister=listDir, checksum=False, recursive=True, filter=None, marks=False, skip=None):
+    """  Walks the source and destination trees together, once, and yields an Action for each difference.
+
+         sourceDir and destDir are the two directories to be mirrored, destDir does not need to exist.
+         A directory that is only in one tree is only scanned on that side.
+         destLister returns the listing of a destination directory, this can be replaced by the manifest.
+         If checksum is true, a SAME action is yielded for files that look the same, so their contents can be checked.
+         If recursive is false, only sourceDir itself is compared - a sub directory in both trees is left alone,
+         one only in one tree is still walked, to be copied or deleted.  Used by --watch for the changed directories.
+         If a myFilter.Filter is given, what it leaves out of the source is never walked, and is left alone in the
+         destination [unless filter.deleteExcluded].
+         If marks is true, a SCANNED action is yielded for each directory once it, and everything under it, has
+         been walked - after all the actions under it.  Directories that will be empty are left out.  Used by the
+         journal, see myJournal.py.  skip is a set of destination directories that are in both trees and left
+         alone, not walked, as the sub directories are if not recursive.  Used by --resume.
+
+         If a source directory can not be read an ERROR action is yielded and nothing under it
+         is touched, otherwise the whole destination directory would be deleted.
+
+         A destination directory that will be empty once the files in it are deleted, and has nothing
+         copied into it, is yielded as an EMPTYDIR when its parent is finished [bottom up].  Only the
+         top of an empty subtree is yielded, action.size is the number of directories in the subtree.
+    """
+    rootFrame = Frame(os.fspath(sourceDir), os.fspath(destDir), True, True, None)
+    stack     = [rootFrame]
+    empty     = Listing()
+    join      = os.path.join
+
+    while stack:
+        frame = stack.pop()
+        if frame.parent is not None:
+            frame.sourceDir = join(frame.parent.sourceDir, frame.sourceName)
+            frame.destDir   = join(frame.parent.destDir, frame.destName)
+        sourceDir, destDir = frame.sourceDir, frame.destDir
+
+        sourceEntries = empty
+        destEntries   = empty
+        try:
+            if frame.inSource:
+                sourceEntries = listDir(sourceDir, filter)
+                _scanFiles.inc(len(sourceEntries) - sum(sourceEntries.isDir))     # Once per directory, as the stats.
+                _scanBytes.inc(sum(sourceEntries.size))
+            if frame.inDest:
+                destEntries = destLister(destDir)
+                if filter is not None and not filter.deleteExcluded:
+                    destEntries, hidden = filter.filterEntries(filter.relative(sourceDir), destEntries)
+                    frame.kept += hidden            # Left alone, so the directory is not empty.
+        except FileNotFoundError:
+            if frame is not rootFrame:              # A missing destination root is copied into.
+                frame.inDest = False
+                yield from finish(frame, rootFrame, marks)
+                continue
+        except OSError as error:
+            yield Action(ERROR, sourceDir, destDir, error=error)
+            frame.kept = 1                          # Never treat a directory that can't be read as empty.
+            yield from finish(frame, rootFrame, marks)
+            continue
+
+        sNames, sDirs, sSizes, sMtimes = sourceEntries.names, sourceEntries.isDir, sourceEntries.size, sourceEntries.mtime
+        dNames, dDirs, dSizes, dMtimes = destEntries.names, destEntries.isDir, destEntries.size, destEntries.mtime
+
+        subDirs = []
+        for s, d in mergeJoin(sourceEntries.keys, destEntries.keys):
+            sourceName = sNames[s] if s is not None else dNames[d]
+            destName   = dNames[d] if d is not None else sourceName
+            sourcePath = join(sourceDir, sourceName)
+            destPath   = join(destDir, destName)
+            sourceFile = s is not None and not sDirs[s]
+
+            if d is not None and not dDirs[d] and not sourceFile:
+                yield Action(DELETE, sourcePath, destPath, dSizes[d], dMtimes[d])
+                d = None                            # Replaced by a source directory, or not in source.
+
+            if s is None:
+                if d is not None:
+                    subDirs.append(Frame(sourceName, destName, False, True, frame))
+                continue
+            if not sourceFile:
+                if d is None or (recursive and not (skip and destPath in skip)):
+                    subDirs.append(Frame(sourceName, destName, True, d is not None, frame))
+                else:
+                    frame.kept += 1                 # In both trees, left alone.
+                    if recursive:
+                        _skipped.inc()
+                continue
+
+            frame.kept += 1                         # The destination will have this file.
+            if d is None:
+                yield Action(COPY, sourcePath, destPath, sSizes[s], sMtimes[s])
+            elif dDirs[d]:                          # A source file is a directory in the destination.
+                subDirs.append(Frame(sourceName, destName, False, True, frame))
+                yield Action(COPY, sourcePath, destPath, sSizes[s], sMtimes[s])
+            elif sSizes[s] != dSizes[d]:
+                yield Action(SIZE, sourcePath, destPath, sSizes[s], sMtimes[s])
+            elif sMtimes[s] > dMtimes[d]:
+                yield Action(DATE, sourcePath, destPath, sSizes[s], sMtimes[s])
+            elif checksum:
+                yield Action(SAME, sourcePath, destPath, sSizes[s], sMtimes[s])
+
+        frame.pending = len(subDirs)
+        frame.walked  = True
+        if subDirs:
+            stack.extend(reversed(subDirs))
+        else:
+            yield from finish(frame, rootFrame, marks)
+
+
+def finish(frame, rootFrame, marks=False):
+    """  Called when a directory, and everything under it, has been walked.
+
+         Passes up to the parent whether the directory will be empty, and finishes the parent if this
+         was its last sub directory.  A directory that will not be empty yields an EMPTYDIR for each of its
+         empty sub directories, they are the tops of the empty subtrees.  If marks, it then yields a SCANNED
+         for itself - unless it could not be read [never walked].
+    """
+    while frame is not None:
+        empty = frame.kept == 0 and frame is not rootFrame
+
+        if not empty:
+            for destDir, sourceDir, count in frame.emptyDirs:
+                yield Action(EMPTYDIR, sourceDir, destDir, count)
+            frame.emptyDirs = []
+            if marks and frame.walked:
+                yield Action(SCANNED, frame.sourceDir, frame.destDir)
+
+        parent = frame.parent
+        if parent is None:
+            return
+
+        if not empty:
+            parent.kept += 1
+        elif frame.inDest:
+            parent.emptyDirs.append((frame.destDir, frame.sourceDir, 1 + sum(c for _, _, c in frame.emptyDirs)))
+
+        parent.pending -= 1
+        if parent.pending or not parent.walked:
+            return
+        frame = parent
@@ -0,0 +1,205 @@
+###############################################################################################################
+#                                                                                                             #
+#  Filters - leave files and whole directories out of the backup, gitignore style.                           #
+#                                                                                                             #
+#  The patterns are compiled once into regular expressions, and each entry is checked as its directory is    #
+#  listed - an excluded directory is never walked, an excluded file is not even stat'ed.  Files can also be  #
+#  left out on their size or age.  What is left out of the source is left alone in the destination, unless   #
+#  deleteExcluded is set.                                                                                      #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        filter = myFilter.Filter(sourceDir, ["node_modules/", ".git/", "*.tmp", "!keep.tmp"], maxSize=1024**3)
+        if filter.excluded("src/build", isDir=True):
+            ....
+
+    The patterns are as .gitignore :
+        name        matches a file or directory called name, anywhere in the tree.  * ? and [abc] as usual.
+        dir/        only matches directories.
+        a/b, /a     with a / [other than at the end] the pattern is from the top of the source.
+        **          any number of directories, i.e. **/cache, logs/**, a/**/b.
+        !pattern    puts back something an earlier pattern left out, the last pattern to match wins.
+        # comment   blank lines and comments are ignored.
+    As with git, nothing can be put back under a directory that has been left out, it is never walked.
+"""
+
+import os
+import re
+import time
+
+_FLAGS = re.IGNORECASE if os.name == "nt" else 0      # Windows file names are not case sensitive.
+
+
+class Rule():
+    """  One compiled pattern.
+    """
+    __slots__ = ("regex", "negate", "dirOnly", "anchored")
+
+    def __init__(self, pattern):
+        pattern     = pattern.rstrip(" ")             # As git, trailing spaces are ignored.
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        elif pattern.startswith("\\"):                # \! and \# are a literal ! or #.
+            pattern = pattern[1:]
+
+        self.dirOnly = pattern.endswith("/")
+        pattern      = pattern.rstrip("/")
+        self.anchored = "/" in pattern               # Otherwise matched against just the name.
+        self.regex    = re.compile(translate(pattern.lstrip("/")) + r"\Z", _FLAGS)
+
+
+def translate(pattern):
+    """  Returns the regular expression for a gitignore pattern.
+    """
+    result = []
+    i      = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            result.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            result.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            result.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            result.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            result.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end   = pattern.index("]", i + 2)
+            chars = pattern[i + 1:end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            result.append("[" + chars.replace("\\", "\\\\") + "]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            result.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            result.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(result)
+
+
+def readPatterns(fileName):
+    """  Returns the patterns in a .gitignore style file.
+    """
+    with open(fileName, encoding="utf-8") as f:
+        return [line.rstrip("\r\n") for line in f]
+
+
+class Filter():
+    """  Decides what is left out of the backup, root is the source directory the patterns are relative to.
+
+         minSize, maxSize - files smaller or larger, in bytes, are left out, 0 is no limit.
+         minAge, maxAge   - files changed more recently, or longer ago, in days are left out, 0 is no limit.
+         deleteExcluded   - if true, what is left out is deleted from the destination, otherwise left alone.
+    """
+
+    def __init__(self, root, patterns=(), minSize=0, maxSize=0, minAge=0, maxAge=0, deleteExcluded=False):
+        self.root           = os.fspath(root)
+        self.rules          = [Rule(p) for p in patterns if p.strip() and not p.startswith("#")]
+        self.minSize        = minSize
+        self.maxSize        = maxSize
+        self.deleteExcluded = deleteExcluded
+        now                 = time.time()
+        self.newest         = now - minAge * 86400 if minAge else None     # mtimes after this are too new.
+        self.oldest         = now - maxAge * 86400 if maxAge else None     # mtimes before this are too old.
+        self.hasLimits      = bool(minSize or maxSize or minAge or maxAge)
+
+        # With no ! patterns the order does not matter, so the patterns are joined into one expression
+        # for each kind [name or path, files and directories or just directories], at most four matches.
+        self.fast = None
+        if not any(rule.negate for rule in self.rules):
+            groups = {}
+            for rule in self.rules:
+                groups.setdefault((rule.anchored, rule.dirOnly), []).append(rule.regex.pattern)
+            self.fast = [(anchored, dirOnly, re.compile("|".join(f"(?:{p})" for p in regexes), _FLAGS))
+                         for (anchored, dirOnly), regexes in groups.items()]
+
+    @property
+    def active(self):
+        return bool(self.rules) or self.hasLimits
+
+    @property
+    def key(self):
+        """  What the filters leave out of the destination's walk, stored with the manifest.
+             Only the patterns matter, the size and age limits never stop a directory being walked.
+        """
+        if self.deleteExcluded:
+            return ""
+        return "\n".join(f"{'!' if r.negate else ''}{r.regex.pattern}{'/' if r.dirOnly else ''}" for r in self.rules)
+
+    def relative(self, path):
+        """  Returns path relative to root, with / as the separator.  Used for the directory being listed.
+        """
+        rel = path[len(self.root):].lstrip(os.sep)
+        return rel.replace(os.sep, "/") if os.sep != "/" else rel
+
+    def excluded(self, relPath, isDir, name=None):
+        """  Returns true if the patterns leave out relPath [relative to root, / separated].
+        """
+        if name is None:
+            name = relPath.rpartition("/")[2]
+
+        if self.fast is not None:
+            for anchored, dirOnly, regex in self.fast:
+                if (isDir or not dirOnly) and regex.match(relPath if anchored else name):
+                    return True
+            return False
+
+        for rule in reversed(self.rules):           # The last pattern to match wins.
+            if rule.dirOnly and not isDir:
+                continue
+            if rule.regex.match(relPath if rule.anchored else name):
+                return not rule.negate
+        return False
+
+    def outOfLimits(self, size, mtime):
+        """  Returns true if a file of this size and mtime is left out.
+        """
+        return bool((self.minSize and size < self.minSize)
+                    or (self.maxSize and size > self.maxSize)
+                    or (self.newest is not None and mtime > self.newest)
+                    or (self.oldest is not None and mtime < self.oldest))
+
+    def excludedDir(self, path):
+        """  Returns true if the directory path [a full path, under root] is left out.
+        """
+        return path != self.root and self.excluded(self.relative(path), True)
+
+    def filterEntries(self, relDir, entries):
+        """  Returns the myDiff.Listing of a destination directory less the entries left out, and the number
+             that are.  The entries left out are not deleted, so their directory is not empty.
+        """
+        prefix = relDir + "/" if relDir else ""
+        names, isDir, size, mtime = entries.names, entries.isDir, entries.size, entries.mtime
+        kept   = [i for i, name in enumerate(names)
+                  if not self.excluded(prefix + name, isDir[i], name)
+                  and (isDir[i] or not self.hasLimits or not self.outOfLimits(size[i], mtime[i]))]
+        if len(kept) == len(names):
+            return entries, 0
+        return entries.select(kept), len(names) - len(kept)
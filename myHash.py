@@ -0,0 +1,234 @@
+###############################################################################################################
+#                                                                                                             #
+#  Content hashing for the --checksum mode, with a persistent cache of the hashes.                           #
+#                                                                                                             #
+#  Files that look the same [same size and date] are hashed on a pool of processes and the hashes compared.  #
+#  The hashes are cached on (device, inode, size, mtime_ns), so a file that has not changed is never         #
+#  read again.  The cache is a SQLite database held in the destination directory.                            #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        cache = myHash.HashCache(destDir, mirrorRoot, maxEntries)
+        for action in myHash.verify(sameActions, cache, workers, pool):
+            ....                                    # action.mode is myDiff.HASH, contents have changed.
+        hashes, keys = myHash.hashFiles(paths, cache, workers, pool)
+        cache.commit()
+"""
+
+import os
+import mmap
+import sqlite3
+import signal
+import hashlib
+import concurrent.futures
+import myDiff
+import myMetrics
+
+CACHE_NAME  = "pyBackup.manifest.hashes"            # Starts with the manifest name, so is never mirrored.
+CACHE_VERSION = 1                                   # Entries kept for each mirror root, an older cache is emptied.
+BUFFER_SIZE = 1024 * 1024
+MMAP_SIZE   = 16 * 1024 * 1024                      # Files at least this size are read using mmap.
+
+
+def hashFile(path):
+    """  Returns the blake2b hash of the file, as a hex string.
+         Large files are read using mmap, smaller ones through a large buffer.
+         Runs in one of the hashing processes.
+    """
+    hash = hashlib.blake2b(digest_size=32)
+
+    with open(path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                hash.update(m)
+        else:
+            view = memoryview(bytearray(BUFFER_SIZE))
+            while True:
+                read = f.readinto(view)
+                if not read:
+                    break
+                hash.update(view[:read])
+
+    return hash.hexdigest()
+
+
+def newPool(workers=None):
+    """  Returns a pool of processes to hash files on, Ctrl-C is left to the main process to deal with.
+    """
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=signal.signal,
+                                                  initargs=(signal.SIGINT, signal.SIG_IGN))
+
+
+def fileKey(path):
+    """  Returns the cache key of the file, (device, inode, size, mtime_ns).
+    """
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HashCache():
+    """  A cache of file hashes, keyed on (device, inode, size, mtime_ns).
+
+         Each mirror root in the destination has its own entries and run numbers, as in the manifest, so the
+         sources backed up to the same destination [jobs] do not remove each other's entries.
+         Each run has a number, entries are marked with the last run they were used in.  At commit the
+         entries of this mirror root not used this run [the file has gone or changed] are removed, and if
+         there are still more than maxEntries the least recently used are removed.
+
+         If readOnly is true [test mode] nothing is written to disk.
+         Only used by one thread at a time, but not always the one that created it.
+    """
+
+    def __init__(self, destDir, mirrorRoot, maxEntries=5000000, readOnly=False):
+        self.fileName   = os.path.join(destDir, CACHE_NAME)
+        self.root       = os.fsencode(os.path.relpath(mirrorRoot, destDir).replace(os.sep, "/"))
+        self.maxEntries = maxEntries
+        self.readOnly   = readOnly
+
+        if readOnly and not os.path.exists(self.fileName):
+            self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(self.fileName, check_same_thread=False)
+
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < CACHE_VERSION:
+            if readOnly:                                # Never changed in test mode, start with an empty one.
+                self.connection.close()
+                self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+            self.connection.execute("DROP TABLE IF EXISTS hashes")      # Only a cache, emptied.
+            self.connection.execute("DROP TABLE IF EXISTS runs")
+            self.connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS hashes (
+                                       root   BLOB,
+                                       dev    INTEGER,
+                                       inode  INTEGER,
+                                       size   INTEGER,
+                                       mtime  INTEGER,
+                                       hash   TEXT,
+                                       seen   INTEGER,
+                                       PRIMARY KEY (root, dev, inode, size, mtime)) WITHOUT ROWID""")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS runs (root BLOB PRIMARY KEY, run INTEGER)")
+        row = self.connection.execute("SELECT run FROM runs WHERE root = ?", (self.root,)).fetchone()
+        self.run = (row[0] if row else 0) + 1
+        self.connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (self.root, self.run))
+
+    def get(self, key):
+        """  Returns the cached hash for key, or None.
+        """
+        row = self.connection.execute("SELECT hash FROM hashes WHERE root = ? AND dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                                      (self.root, *key)).fetchone()
+        if row is None:
+            return None
+
+        self.connection.execute("UPDATE hashes SET seen = ? WHERE root = ? AND dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                                (self.run, self.root, *key))
+        return row[0]
+
+    def forget(self, key):
+        self.connection.execute("DELETE FROM hashes WHERE root = ? AND dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                                (self.root, *key))
+
+    def put(self, key, hash):
+        self.connection.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)", (self.root, *key, hash, self.run))
+
+    def commit(self):
+        """  Removes this mirror root's entries not used this run, trims them to maxEntries and writes the cache.
+        """
+        if self.readOnly:
+            self.connection.rollback()
+            return
+
+        self.connection.execute("DELETE FROM hashes WHERE root = ? AND seen < ?", (self.root, self.run))
+        count = self.connection.execute("SELECT COUNT(*) FROM hashes WHERE root = ?", (self.root,)).fetchone()[0]
+        if count > self.maxEntries:
+            self.connection.execute("""DELETE FROM hashes WHERE root = ? AND (dev, inode, size, mtime) IN
+                                          (SELECT dev, inode, size, mtime FROM hashes WHERE root = ? ORDER BY seen LIMIT ?)""",
+                                    (self.root, self.root, count - self.maxEntries))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def hashFiles(paths, cache, workers=None, pool=None):
+    """  Returns (path : hash, path : cache key) for each of paths that can be read.
+
+         Hashes are taken from the cache if possible, the rest are worked out on a pool of processes and cached.
+         If pool is given it is used, rather than starting a pool for each call - this is called in batches.
+    """
+    hits    = myMetrics.METRICS.counter("hash_cache_total", "Hash cache lookups, by result.", result="hit")
+    misses  = myMetrics.METRICS.counter("hash_cache_total", "Hash cache lookups, by result.", result="miss")
+    hashes  = {}                                    # path : hash
+    keys    = {}                                    # path : key
+    missing = []
+
+    for path in paths:
+        try:
+            key = fileKey(path)
+        except OSError:
+            continue
+        keys[path] = key
+        hash = cache.get(key)
+        if hash is None:
+            missing.append(path)
+        else:
+            hashes[path] = hash
+    hits.inc(len(hashes))
+    misses.inc(len(missing))
+
+    if missing:
+        ownPool = pool is None
+        if ownPool:
+            pool = newPool(workers)
+        try:
+            futures = {pool.submit(hashFile, path): path for path in missing}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    hashes[path] = future.result()
+                except OSError:
+                    continue
+                cache.put(keys[path], hashes[path])
+        finally:
+            if ownPool:
+                pool.shutdown()
+
+    return hashes, keys
+
+
+def verify(actions, cache, workers=None, pool=None):
+    """  Compares the contents of each pair of files in actions [myDiff.SAME actions], yields a
+         myDiff.HASH action for each pair whose contents differ.
+
+         The hashes come from hashFiles(), a file that can not be read is skipped, it is left as it is.
+
+         The copy keeps the size and mtime, and maybe the inode, so the destination's key will not change
+         when it is copied over - its cache entry is forgotten, so it is hashed again next run.
+    """
+    hashes, keys = hashFiles([path for action in actions for path in (action.sourcePath, action.destPath)],
+                             cache, workers, pool)
+
+    for action in actions:
+        sourceHash = hashes.get(action.sourcePath)
+        destHash   = hashes.get(action.destPath)
+        if sourceHash and destHash and sourceHash != destHash:
+            cache.forget(keys[action.destPath])
+            yield myDiff.Action(myDiff.HASH, action.sourcePath, action.destPath, action.size, action.mtime)
@@ -0,0 +1,276 @@
+###############################################################################################################
+#                                                                                                             #
+#  Backup jobs - runs the jobs described in config.toml, alongside each other where they can.                #
+#                                                                                                             #
+#  Jobs that touch different physical disks run at the same time, jobs that share a disk wait for each      #
+#  other.  The total number of copy threads over all the running jobs is kept within a global I/O budget.    #
+#  Each job is a pyBackup.py process of its own, at the end a combined report of all the jobs is printed.   #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        jobs      = myJobs.loadJobs(myConfig.JOBS(), names)
+        scheduler = myJobs.Scheduler(jobs, ioBudget=8, maxJobs=4)
+        scheduler.run()                     # waits for all the jobs to finish.
+        myJobs.printReport(jobs)
+
+    A job is [[JOBS]] in config.toml, with name, source, destination and optionally zap, test, checksum, snapshot,
+    priority [higher runs first], workers [copy threads, counted against the I/O budget] and the filters, as [FILTER].
+    A job's exclude patterns are added to those in [FILTER], its limits replace them.
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import tempfile
+import threading
+import subprocess
+
+PYBACKUP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyBackup.py")
+
+FILTER_KEYS = ("exclude", "minSize", "maxSize", "minAge", "maxAge", "deleteExcluded")
+
+
+class Job():
+    """  One backup job, a source mirrored to a destination.
+    """
+
+    def __init__(self, name, source, destination, zap=False, test=False, checksum=False, priority=0, workers=4,
+                 snapshot=False, filters=None):
+        self.name        = name
+        self.source      = source
+        self.destination = destination
+        self.zap         = zap
+        self.test        = test
+        self.checksum    = checksum
+        self.priority    = priority
+        self.workers     = workers
+        self.snapshot    = snapshot
+        self.filters     = filters or {}            # exclude, minSize, maxSize, minAge, maxAge, deleteExcluded.
+        self.devices     = {physicalDevice(source), physicalDevice(destination)}
+        self.exitCode    = None
+        self.seconds     = 0.0
+        self.metrics     = {}                       # The job's metrics, read from its JSON report.
+
+    def command(self, reportFile, metricsFile=None):
+        command = [sys.executable, PYBACKUP, "-s", self.source, "-d", self.destination,
+                   "-w", str(self.workers), "--job", self.name, "--job-report", reportFile]
+        if metricsFile:
+            command.extend(["--metrics", metricsFile])
+        if self.zap:
+            command.append("-z")
+        if self.test:
+            command.append("-t")
+        if self.checksum:
+            command.append("-c")
+        if self.snapshot:
+            command.append("--snapshot")
+        for pattern in self.filters.get("exclude", []):
+            command.append(f"--exclude={pattern}")
+        for key, flag in (("minSize", "--min-size"), ("maxSize", "--max-size"), ("minAge", "--min-age"), ("maxAge", "--max-age")):
+            if key in self.filters:
+                command.append(f"{flag}={self.filters[key]}")
+        if self.filters.get("deleteExcluded"):
+            command.append("--delete-excluded")
+        return command
+
+    def run(self, printLock, metricsFile=None):
+        """  Runs the job as a pyBackup.py process, its output is printed with the job name in front.
+             The metrics are always written as JSON to a temporary file, read back for the combined report,
+             and also to metricsFile if given [a Prometheus textfile].
+        """
+        handle, reportFile = tempfile.mkstemp(prefix=f"pyBackup-{self.name}-", suffix=".json")
+        os.close(handle)
+
+        start = time.perf_counter()
+        with subprocess.Popen(self.command(reportFile, metricsFile), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True, bufsize=1) as process:
+            for line in process.stdout:
+                with printLock:
+                    print(f"[{self.name}] {line}", end="", flush=True)
+            self.exitCode = process.wait()
+        self.seconds = time.perf_counter() - start
+
+        try:
+            with open(reportFile) as f:
+                self.metrics = json.load(f)
+        except (OSError, ValueError):               # Empty if the job stopped before writing it.
+            self.metrics = {}
+        os.remove(reportFile)
+
+    def value(self, name, **labels):
+        """  Returns the total of the job's metric name, over the metrics that have all of labels.
+        """
+        total = 0
+        for metric in self.metrics.get(name, {}).get("metrics", []):
+            if all(metric["labels"].get(k) == v for k, v in labels.items()):
+                total += metric.get("value", metric.get("sum", 0))
+        return total
+
+
+def loadJobs(jobTables, names=None, defaultWorkers=4):
+    """  Returns the jobs from the [[JOBS]] tables of config.toml, only those in names if given.
+         Raises ValueError if a job is missing a name, source or destination, or a name is not found.
+    """
+    jobs = []
+    for n, table in enumerate(jobTables):
+        for key in ("name", "source", "destination"):
+            if not table.get(key):
+                raise ValueError(f"job {n + 1} in config.toml has no {key}")
+        if names and table["name"] not in names:
+            continue
+        jobs.append(Job(table["name"], table["source"], table["destination"],
+                        zap=table.get("zap", False), test=table.get("test", False),
+                        checksum=table.get("checksum", False), priority=table.get("priority", 0),
+                        workers=table.get("workers", defaultWorkers), snapshot=table.get("snapshot", False),
+                        filters={key: table[key] for key in FILTER_KEYS if key in table}))
+
+    missing = set(names or []) - {job.name for job in jobs}
+    if missing:
+        raise ValueError(f"no job called {', '.join(sorted(missing))} in config.toml")
+    return jobs
+
+
+def physicalDevice(path):
+    """  Returns the physical disk that path is on, on Linux the partition is traced back to its disk
+         through /sys, elsewhere the st_dev of the file system is used.
+         If path does not exist yet, the nearest parent that does is used.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+
+    dev = os.stat(path).st_dev
+    try:
+        block = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    except OSError:
+        return dev
+    if not os.path.exists(block):
+        return dev                                  # Not a block device, tmpfs, nfs etc.
+    if os.path.exists(os.path.join(block, "partition")):
+        block = os.path.dirname(block)              # sda1 -> sda
+    return os.path.basename(block)
+
+
+class Scheduler():
+    """  Runs the jobs, highest priority first, at most maxJobs at once.
+
+         A job is only started if no running job shares a physical disk with it, and the copy threads of the
+         running jobs plus its own are within ioBudget - unless nothing is running, so a job larger than the
+         budget still runs, alone.
+    """
+
+    def __init__(self, jobs, ioBudget=8, maxJobs=4, metricsFile=None):
+        self.jobs        = sorted(jobs, key=lambda job: -job.priority)
+        self.ioBudget    = ioBudget
+        self.maxJobs     = maxJobs
+        self.metricsFile = metricsFile
+        self.condition   = threading.Condition()
+        self.printLock   = threading.Lock()
+        self.running     = []
+        self.cancelled   = False
+
+    def canStart(self, job):
+        if not self.running:
+            return True
+        if len(self.running) >= self.maxJobs:
+            return False
+        if sum(j.workers for j in self.running) + job.workers > self.ioBudget:
+            return False
+        return not any(job.devices & j.devices for j in self.running)
+
+    def run(self):
+        """  Runs all the jobs, returns once they have all finished.
+             On Ctrl-C no more jobs are started, the running jobs see the Ctrl-C too and stop cleanly.
+        """
+        pending = list(self.jobs)
+        threads = []
+
+        with self.condition:
+            while pending or self.running:
+                try:
+                    for job in list(pending):
+                        if self.cancelled or not self.canStart(job):
+                            continue
+                        pending.remove(job)
+                        self.running.append(job)
+                        thread = threading.Thread(target=self._run, args=(job,), name=job.name, daemon=True)
+                        threads.append(thread)
+                        thread.start()
+                    if self.cancelled:
+                        pending = []
+                    self.condition.wait()
+                except KeyboardInterrupt:
+                    self.cancelled = True
+
+        for thread in threads:
+            thread.join()
+
+    def _run(self, job):
+        try:
+            job.run(self.printLock, self._metricsFile(job))
+        finally:
+            with self.condition:
+                self.running.remove(job)
+                self.condition.notify()
+
+    def _metricsFile(self, job):
+        """  A Prometheus textfile per job, name-job.prom, so the textfile collector picks up each one.
+             Otherwise the combined report goes to metricsFile, the job's metrics are only in its JSON report.
+        """
+        if self.metricsFile and self.metricsFile.endswith(".prom"):
+            return f"{self.metricsFile[:-len('.prom')]}-{job.name}.prom"
+        return None
+
+
+def printReport(jobs):
+    """  Prints one line for each job and the totals, returns true if every job finished cleanly.
+    """
+    copied = ("new", "size", "date", "hash")
+
+    print()
+    print(f"{'Job':20} {'Result':10} {'Time':>16} {'Copied':>8} {'Bytes':>14} {'Moved':>8} {'Deleted':>8} {'Errors':>7}")
+    totals = [0, 0, 0, 0, 0]
+    for job in jobs:
+        values = [sum(job.value("files_total", mode=mode) for mode in copied),
+                  sum(job.value("bytes_total", mode=mode) for mode in copied),
+                  job.value("files_total", mode="moved"),
+                  job.value("files_total", mode="deleted"),
+                  job.value("errors_total")]
+        totals = [t + v for t, v in zip(totals, values)]
+        result = {None: "not run", 0: "ok", 6: "cancelled", 12: "errors"}.get(job.exitCode, f"failed {job.exitCode}")
+        print(f"{job.name:20} {result:10} {str(datetime.timedelta(seconds=int(job.seconds))):>16} "
+              f"{values[0]:8} {values[1]:14} {values[2]:8} {values[3]:8} {values[4]:7}")
+    print(f"{'Total':20} {'':10} {'':>16} {totals[0]:8} {totals[1]:14} {totals[2]:8} {totals[3]:8} {totals[4]:7}")
+
+    return all(job.exitCode == 0 for job in jobs)
+
+
+def writeReport(jobs, fileName):
+    """  Writes the combined report, every job's result and metrics, as JSON.
+    """
+    report = [{"name": job.name, "source": job.source, "destination": job.destination,
+               "exitCode": job.exitCode, "seconds": job.seconds, "metrics": job.metrics} for job in jobs]
+    tmpName = f"{fileName}.{os.getpid()}.tmp"
+    with open(tmpName, "w") as f:
+        json.dump({"jobs": report}, f, indent=2)
+    os.replace(tmpName, fileName)
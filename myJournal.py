@@ -0,0 +1,221 @@
+###############################################################################################################
+#                                                                                                             #
+#  Journal - an append-only record of what a run has done, so an interrupted run can be carried on.          #
+#                                                                                                             #
+#  Each copy is recorded as started and completed, and each delete and move as completed.  Once a directory  #
+#  has been scanned and everything found under it done, it is recorded as complete.  After a crash or Ctrl-C #
+#  the copies left part written are removed, and --resume carries on without scanning the complete           #
+#  directories again.  The journal is removed once a run completes.                                          #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        journal  = myJournal.Journal(destDir, mirrorRoot)
+        previous = journal.recover()        # the interrupted run, if any, its part written copies are removed.
+        journal.begin(sourceDir, resume, manifestClean)
+        for action in myDiff.diffTrees(sourceDir, mirrorRoot, marks=True, skip=previous.complete if resume else None):
+            ....                            # journal.plan(), started(), done(), scanned() as the actions go through.
+        journal.close(complete)             # removed if complete.
+
+    The journal is held in destDir as pyBackup.manifest.journal, one JSON list per line :
+        ["B", sourceDir, mirrorRoot, manifestClean, time]       a run has begun.
+        ["P", path]                                             a copy to path has started.
+        ["C", kind, path, movedFrom]                            a copy, delete or move has completed.
+        ["T", dir]                                              dir, and everything under it, is complete.
+    Each line is flushed as written, so survives the program being killed.  A line cut short is ignored.
+"""
+
+import os
+import json
+import time
+import threading
+import myCopy
+import myManifest
+
+JOURNAL_NAME = myManifest.MANIFEST_NAME + ".journal"
+
+
+class Recovery():
+    """  What the journal says about the run, or runs, being resumed.
+
+         complete  - the destination directories that were complete.
+         completed - the (kind, path, movedFrom) of each copy, delete and move done, in order.
+         manifestClean - true if the manifest was up to date when the first of the runs began.
+    """
+
+    def __init__(self):
+        self.sourceDir     = None
+        self.mirrorRoot    = None
+        self.manifestClean = False
+        self.complete      = set()
+        self.completed     = []
+        self.started       = set()                  # Copies started and not completed.
+
+    def replay(self, manifest):
+        """  Puts the copies, deletes and moves completed into the manifest, the changes made to the
+             directories that are not walked again.
+        """
+        for kind, path, movedFrom in self.completed:
+            try:
+                if kind == "copy":
+                    manifest.addDir(os.path.dirname(path))
+                    manifest.addFile(path)
+                elif kind == "delete":
+                    manifest.remove(path)
+                elif kind == "move":
+                    manifest.move(movedFrom, path)
+            except OSError:
+                continue                            # Changed since, it is under a directory walked again.
+
+
+class Journal():
+    """  The journal of this run, held in destDir.  mirrorRoot is the destination directory being mirrored.
+
+         Every action under a directory is planned when the compare stage gets it, and done once it has been
+         copied, deleted or moved.  A directory is complete once it has been scanned and nothing under it is
+         still to be done.  An action that fails is never done, so the directories above it are never complete.
+         The methods can be called from any thread.
+    """
+
+    def __init__(self, destDir, mirrorRoot):
+        self.fileName    = os.path.join(destDir, JOURNAL_NAME)
+        self.mirrorRoot  = os.fspath(mirrorRoot)
+        self.lock        = threading.Lock()
+        self.file        = None
+        self.outstanding = {}                       # directory : actions under it not yet done.
+        self.scannedDirs = set()                    # directories scanned, with actions under them not yet done.
+
+    def recover(self, removeTemps=True):
+        """  Reads the journal left by an interrupted run, returns a Recovery or None if there is none.
+             The copies started and not completed are removed, unless removeTemps is false [test mode].
+        """
+        try:
+            f = open(self.fileName, encoding="utf-8", errors="surrogateescape")
+        except FileNotFoundError:
+            return None
+
+        recovery = Recovery()
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue                        # Cut short by a crash.
+                kind = record[0]
+                if kind == "B":
+                    if recovery.sourceDir is None:
+                        recovery.manifestClean = record[3]
+                    recovery.sourceDir, recovery.mirrorRoot = record[1], record[2]
+                elif kind == "P":
+                    recovery.started.add(record[1])
+                elif kind == "C":
+                    recovery.completed.append(tuple(record[1:4]))
+                    recovery.started.discard(record[2])
+                elif kind == "T":
+                    recovery.complete.add(record[1])
+
+        if removeTemps:
+            for path in recovery.started:
+                try:
+                    os.remove(myCopy.tempName(path))
+                except OSError:
+                    pass
+        return recovery
+
+    def begin(self, sourceDir, resume=False, manifestClean=False):
+        """  Starts the journal of this run, carrying on from the journal already there if resume.
+        """
+        self.file = open(self.fileName, "a" if resume else "w", encoding="utf-8", errors="surrogateescape")
+        self._write(["B", os.fspath(sourceDir), self.mirrorRoot, manifestClean, time.time()])
+
+    def close(self, complete=False):
+        """  Closes the journal, if the run is complete it is not needed and is removed.
+        """
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if complete:
+            os.remove(self.fileName)
+
+    def _write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def _dirs(self, path):
+        """  The directories above path, up to and including the mirror root.
+        """
+        dir = os.path.dirname(path)
+        while len(dir) >= len(self.mirrorRoot):
+            yield dir
+            up = os.path.dirname(dir)
+            if up == dir:
+                break
+            dir = up
+
+    def plan(self, path):
+        """  An action on path is to be done, the directories above it are not complete until it is.
+        """
+        with self.lock:
+            for dir in self._dirs(path):
+                self.outstanding[dir] = self.outstanding.get(dir, 0) + 1
+
+    def scanned(self, dir):
+        """  dir, and everything under it, has been scanned.  Complete if nothing under it is still to be done.
+        """
+        with self.lock:
+            if self.outstanding.get(dir):
+                self.scannedDirs.add(dir)
+                return
+        self._write(["T", dir])
+
+    def started(self, path):
+        """  A copy to path has started, if not completed its temporary file is removed next run.
+        """
+        self._write(["P", path])
+
+    def done(self, kind, path, movedFrom=None):
+        """  A copy, delete or move of path has completed, path [and movedFrom] were planned.
+        """
+        self.record(kind, path, movedFrom)
+        self.release((path, movedFrom) if movedFrom else (path,))
+
+    def record(self, kind, path, movedFrom=None):
+        self._write(["C", kind, path, movedFrom])
+
+    def release(self, paths):
+        """  The actions planned on paths are done, or will not be done after all.  The directories that are
+             now complete are recorded.
+        """
+        complete = []
+        with self.lock:
+            for path in paths:
+                for dir in self._dirs(path):
+                    left = self.outstanding[dir] - 1
+                    if left:
+                        self.outstanding[dir] = left
+                        continue
+                    del self.outstanding[dir]
+                    if dir in self.scannedDirs:
+                        self.scannedDirs.discard(dir)
+                        complete.append(dir)
+        for dir in complete:
+            self._write(["T", dir])
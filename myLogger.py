@@ -27,10 +27,18 @@
     to write to log - log.debug(text message) [also can use log, error, info, warning, critical & exception]
 
     can add exc_info=True to include exception information, not needed with log.exception
+
+        logger = myLogger.get_queue_logger(myConfig.NAME() + ".log")
+
+    as get_logger, but the caller only puts the record on a queue, a background thread writes it to the file.
+    Use from threads that should not wait on the disk, the queue is flushed when the program exits.
 """
 
+import sys
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 
 FORMATTER = logging.Formatter("%(asctime)s : %(levelname)s : %(message)s")
@@ -40,8 +48,14 @@ def get_console_handler():
     console_handler.setFormatter(FORMATTER)
     return console_handler
 
+class LogFileHandler(TimedRotatingFileHandler):
+    """  File names that are not UTF-8 are written escaped, rather than the line being lost.
+    """
+    def _open(self):
+        return open(self.baseFilename, self.mode, encoding=self.encoding, errors="backslashreplace")
+
 def get_file_handler(logger_name):
-    file_handler = TimedRotatingFileHandler(logger_name, when="midnight", backupCount=7)  # Only keep 7 previous logs.
+    file_handler = LogFileHandler(logger_name, when="midnight", backupCount=7)  # Only keep 7 previous logs.
     file_handler.setFormatter(FORMATTER)
     return file_handler
 
@@ -52,4 +66,15 @@ def get_logger(logger_name):
     logger.addHandler(get_file_handler(logger_name))
     # with this pattern, it's rarely necessary to propagate the error up to parent
     logger.propagate = False
+    return logger
+
+def get_queue_logger(logger_name):
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(logging.DEBUG)
+    log_queue = queue.SimpleQueue()             # Not bounded, a log call never waits.
+    listener  = QueueListener(log_queue, get_file_handler(logger_name))
+    listener.start()
+    atexit.register(listener.stop)              # Writes what is left in the queue.
+    logger.addHandler(QueueHandler(log_queue))
+    logger.propagate = False
     return logger
\ No newline at end of file
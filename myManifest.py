@@ -0,0 +1,272 @@
+###############################################################################################################
+#                                                                                                             #
+#  A persistent manifest of the destination directory.                                                      #
+#                                                                                                             #
+#  Records the name, size, mtime and inode of everything pyBackup has written to the destination, so the     #
+#  next run can compare the source against the manifest instead of walking the destination.                  #
+#  The manifest is a SQLite database held in the destination directory.                                      #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        manifest = myManifest.Manifest(destDir, mirrorRoot)
+        manifest.begin(rebuild)
+        for action in myDiff.diffTrees(sourceDir, mirrorRoot, manifest.listDir):
+            ....
+        manifest.commit()
+
+    The manifest is marked as not clean at the start of each run and clean again when the run is committed.
+    If a run is interrupted, the manifest is not trusted and the next run walks the destination to rebuild it.
+"""
+
+import os
+import sqlite3
+import itertools
+import threading
+import myDiff
+
+MANIFEST_NAME    = "pyBackup.manifest"
+MANIFEST_VERSION = 1        # Paths stored as bytes, a manifest of an older version is rebuilt.
+
+# The rows of a directory and everything under it, dir is the directory or starts with it and a /.
+# Bounded by [dir, dir + b"0"), "0" follows "/", so the primary key is used rather than every row of the root.
+SUBTREE = "root = ? AND dir >= ? AND dir < ? AND (dir = ? OR dir >= ?)"
+
+
+class Manifest():
+    """  A wrapper around the SQLite manifest held in destDir.
+
+         Each mirror root in the destination has its own set of rows, paths are stored
+         relative to the mirror root with "/" as the separator.  The paths are stored as bytes [BLOBs], from
+         os.fsencode(), so a name that is not valid UTF-8 [legal on Linux] is recorded like any other.
+
+         If readOnly is true [test mode], the manifest is used if it exists but is never created or written.
+         The add and remove methods can be called from the copy threads.
+         filterKey is myFilter.Filter.key, the directories left out are never walked so are not in the manifest -
+         if the filters change the manifest is rebuilt.
+    """
+
+    def __init__(self, destDir, mirrorRoot, readOnly=False, filterKey=""):
+        self.fileName   = os.path.join(destDir, MANIFEST_NAME)
+        self.destDir    = os.fspath(destDir)
+        self.mirrorRoot = os.fspath(mirrorRoot)
+        self.root       = os.fsencode(os.path.relpath(self.mirrorRoot, self.destDir).replace(os.sep, "/"))
+        self.readOnly   = readOnly
+        self.filterKey  = filterKey
+        self.rebuild    = True
+        self.connection = None
+        self.lock       = threading.Lock()
+
+        if readOnly and not os.path.exists(self.fileName):
+            return
+
+        self.connection = sqlite3.connect(self.fileName, check_same_thread=False)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < MANIFEST_VERSION and not readOnly:     # Read only, the old rows are never matched, so rebuilt.
+            for table in ("files", "roots", "filters"):
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute(f"PRAGMA user_version = {MANIFEST_VERSION}")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                                       root  TEXT,
+                                       dir   TEXT,
+                                       name  TEXT,
+                                       isDir INTEGER,
+                                       size  INTEGER,
+                                       mtime REAL,
+                                       inode INTEGER,
+                                       PRIMARY KEY (root, dir, name)) WITHOUT ROWID""")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS roots (root TEXT PRIMARY KEY, clean INTEGER)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS filters (root TEXT PRIMARY KEY, key TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_size ON files (root, size, mtime)")   # For hasFile.
+        self.connection.commit()
+
+    def isClean(self):
+        """  Returns true if the last run for this mirror root was committed, with the same filters.
+        """
+        if self.connection is None:
+            return False
+
+        row = self.connection.execute("SELECT clean FROM roots WHERE root = ?", (self.root,)).fetchone()
+        key = self.connection.execute("SELECT key FROM filters WHERE root = ?", (self.root,)).fetchone()
+        return bool(row and row[0]) and (key[0] if key else "") == self.filterKey
+
+    def begin(self, rebuild, keep=False):
+        """  Start of a run.
+
+             If rebuild is true, or the manifest is not clean, the destination is walked and the manifest
+             rebuilt from that walk, otherwise listDir reads from the manifest.
+             If keep is true the rows are kept, each directory walked has its rows replaced - used by --resume,
+             the directories not walked keep the rows from the run being resumed.
+             The manifest is marked as not clean until commit() is called.
+        """
+        self.rebuild = rebuild or not self.isClean()
+
+        if self.connection is None or self.readOnly:
+            return
+
+        self.connection.execute("INSERT OR REPLACE INTO roots VALUES (?, 0)", (self.root,))
+        self.connection.commit()
+
+        if self.rebuild and not keep:                       # Rows are re-added as the destination is walked.
+            self.connection.execute("DELETE FROM files WHERE root = ?", (self.root,))
+
+    def commit(self, clean=True):
+        """  End of a run, all the changes are written in one transaction and the manifest marked as clean.
+
+             If clean is false [i.e. part of the destination could not be scanned], the changes are
+             still written, but the next run will rebuild the manifest.
+        """
+        if self.connection is None or self.readOnly:
+            return
+
+        self.connection.execute("INSERT OR REPLACE INTO roots VALUES (?, ?)", (self.root, int(clean)))
+        self.connection.execute("INSERT OR REPLACE INTO filters VALUES (?, ?)", (self.root, self.filterKey))
+        self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def relative(self, path):
+        """  Returns path relative to the mirror root, split into the directory and name, as bytes.
+        """
+        path = os.fspath(path)
+        if path == self.mirrorRoot:
+            return b"", b""
+
+        relPath = os.fsencode(path[len(self.mirrorRoot) + 1:].replace(os.sep, "/"))
+        dir, _, name = relPath.rpartition(b"/")
+        return dir, name
+
+    def listDir(self, path):
+        """  Returns the sorted listing of a destination directory, used by myDiff.diffTrees.
+
+             Either read from the manifest, or if rebuilding, from the destination with the entries
+             recorded into the manifest.
+        """
+        if self.rebuild or self.connection is None:
+            entries = myDiff.listDir(path)
+            if os.fspath(path) == self.destDir:             # Don't mirror the manifest itself.
+                entries = entries.select([i for i, name in enumerate(entries.names) if not name.startswith(MANIFEST_NAME)])
+
+            if self.connection is not None and not self.readOnly:
+                dir   = b"/".join(filter(None, self.relative(path)))
+                names = [os.fsencode(name) for name in entries.names]
+                with self.lock:                             # Rows kept from the run being resumed, of names now gone.
+                    stale = self.connection.execute("SELECT name FROM files WHERE root = ? AND dir = ?", (self.root, dir)).fetchall()
+                known = set(names)
+                for name, in stale:
+                    if name not in known:
+                        self.remove(os.path.join(path, os.fsdecode(name)))
+                with self.lock:
+                    self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                                zip(itertools.repeat(self.root), itertools.repeat(dir), names,
+                                                    entries.isDir, entries.size, entries.mtime, entries.inode))
+            return entries
+
+        dir = b"/".join(filter(None, self.relative(path)))
+        with self.lock:                                     # The copy threads write while the scan reads.
+            rows = self.connection.execute("SELECT name, isDir, size, mtime, inode FROM files WHERE root = ? AND dir = ?",
+                                           (self.root, dir)).fetchall()
+        entries = myDiff.Listing()
+        for name, isDir, size, mtime, inode in rows:
+            entries.add(os.fsdecode(name), isDir, size, mtime, inode or 0)
+        return entries.sorted()
+
+    def hasFile(self, size, mtime):
+        """  Returns true if there is a file of this size and mtime anywhere in the destination mirror,
+             or None if not known - the manifest is being rebuilt.
+        """
+        if self.rebuild or self.connection is None:
+            return None
+
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM files WHERE root = ? AND size = ? AND mtime = ? AND isDir = 0 LIMIT 1",
+                                          (self.root, size, mtime)).fetchone()
+        return row is not None
+
+    def addDir(self, path):
+        """  Records a directory, and all its parents up to the mirror root, created in the destination.
+        """
+        if self.connection is None or self.readOnly:
+            return
+
+        dir, name = self.relative(path)
+        with self.lock:
+            while name:
+                self.connection.execute("INSERT OR IGNORE INTO files VALUES (?, ?, ?, 1, 0, 0, 0)", (self.root, dir, name))
+                dir, _, name = dir.rpartition(b"/")
+
+    def addFile(self, path):
+        """  Records a file that has been copied into the destination.
+        """
+        if self.connection is None or self.readOnly:
+            return
+
+        st = os.stat(path)
+        dir, name = self.relative(path)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, 0, ?, ?, ?)",
+                                    (self.root, dir, name, st.st_size, st.st_mtime, st.st_ino))
+
+    def remove(self, path):
+        """  Records a file or directory that has been deleted from the destination.
+             For a directory, everything under it is removed with it.
+        """
+        if self.connection is None or self.readOnly:
+            return
+
+        dir, name = self.relative(path)
+        old       = b"/".join(filter(None, (dir, name)))
+        with self.lock:
+            row = self.connection.execute("SELECT isDir FROM files WHERE root = ? AND dir = ? AND name = ?",
+                                          (self.root, dir, name)).fetchone()
+            self.connection.execute("DELETE FROM files WHERE root = ? AND dir = ? AND name = ?", (self.root, dir, name))
+            if row is None or row[0]:                       # A directory, or not known, so everything under it too.
+                self.connection.execute(f"DELETE FROM files WHERE {SUBTREE}", self._subtree(old))
+
+    def _subtree(self, dir):
+        """  The parameters of SUBTREE for dir, relative to the mirror root.
+        """
+        return (self.root, dir, dir + b"0", dir, dir + b"/")
+
+    def move(self, oldPath, newPath):
+        """  Records a file or directory that has been renamed in the destination.
+             For a directory, everything under it is moved with it.
+        """
+        if self.connection is None or self.readOnly:
+            return
+
+        oldDir, oldName = self.relative(oldPath)
+        newDir, newName = self.relative(newPath)
+        old = b"/".join(filter(None, (oldDir, oldName)))
+        new = b"/".join(filter(None, (newDir, newName)))
+
+        self.addDir(os.path.dirname(newPath))
+        with self.lock:
+            row = self.connection.execute("SELECT isDir FROM files WHERE root = ? AND dir = ? AND name = ?",
+                                          (self.root, oldDir, oldName)).fetchone()
+            self.connection.execute("UPDATE files SET dir = ?, name = ? WHERE root = ? AND dir = ? AND name = ?",
+                                    (newDir, newName, self.root, oldDir, oldName))
+            if row is None or row[0]:                       # A directory, or not known, so everything under it too.
+                self.connection.execute(f"UPDATE files SET dir = CAST(? || substr(dir, ?) AS BLOB) WHERE {SUBTREE}",
+                                        (new, len(old) + 1) + self._subtree(old))
+
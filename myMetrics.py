@@ -0,0 +1,288 @@
+###############################################################################################################
+#                                                                                                             #
+#  Metrics - thread safe counters, gauges and histograms, and optional profiling.                            #
+#                                                                                                             #
+#  The modules record into one registry, METRICS, as they go.  At the end of a run the registry is written   #
+#  as JSON, or as a Prometheus textfile [for the node exporter's textfile collector], so a monitor can        #
+#  alert when the backup throughput drops.                                                                    #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        copied = myMetrics.METRICS.counter("files_total", "Files done, by what was done.", mode="new")
+        copied.inc()
+        with myMetrics.METRICS.histogram("copy_seconds", "Time to copy a file.", myMetrics.TIME_BUCKETS).time():
+            ....
+        myMetrics.METRICS.write("pybackup.prom")     # Prometheus textfile, any other extension is JSON.
+
+        profiler = myMetrics.Profiler()             # cProfile, on every thread started after this.
+        profiler.start()
+        profiler.stop("pybackup.pstats")
+
+    Asking for a metric that already exists returns the same one, so the hot paths look theirs up once.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import cProfile
+import pstats
+import threading
+import contextlib
+import tracemalloc
+
+try:
+    import resource                                 # Not on Windows.
+except ImportError:
+    resource = None
+
+SIZE_BUCKETS = [1024 * 4 ** n for n in range(13)]                  # 1KB up to 16GB.
+TIME_BUCKETS = [0.00001 * 4 ** n for n in range(13)]               # 10us up to about 3 minutes.
+
+
+class Counter():
+    """  A count that only goes up.
+    """
+    kind = "counter"
+
+    def __init__(self):
+        self.lock  = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Gauge():
+    """  A value that is set, can go up or down.
+    """
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram():
+    """  Counts the values observed into buckets, each bucket is the count of values up to its bound.
+    """
+    kind = "histogram"
+
+    def __init__(self, buckets):
+        self.lock    = threading.Lock()
+        self.buckets = sorted(buckets)
+        self.counts  = [0] * (len(self.buckets) + 1)                 # The last is values above every bound.
+        self.sum     = 0
+        self.count   = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum   += value
+            self.count += 1
+
+    def observeMany(self, values):
+        """  Observes a list of values, taking the lock once - for the hot paths.
+        """
+        indexes = [bisect.bisect_left(self.buckets, value) for value in values]
+        with self.lock:
+            for index in indexes:
+                self.counts[index] += 1
+            self.sum   += sum(values)
+            self.count += len(values)
+
+    @contextlib.contextmanager
+    def time(self):
+        """  Observes the time, in seconds, spent in the with block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def value(self):
+        return self.sum
+
+
+class Metrics():
+    """  A registry of metrics, each has a name, a help line and may have labels.
+    """
+
+    def __init__(self, prefix="pybackup"):
+        self.prefix  = prefix
+        self.lock    = threading.Lock()
+        self.metrics = {}                           # (name, labels) : metric
+        self.helps   = {}                           # name : help
+        self.labels  = {}                           # Labels added to every metric in the Prometheus textfile.
+
+    def _get(self, cls, name, help, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = cls(*args)
+                    if help or name not in self.helps:
+                        self.helps[name] = help
+        return metric
+
+    def counter(self, name, help="", **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help="", buckets=TIME_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def value(self, name, **labels):
+        """  Returns the value of a counter or gauge [the sum of a histogram], 0 if it has not been used.
+        """
+        metric = self.metrics.get((name, tuple(sorted(labels.items()))))
+        return metric.value if metric else 0
+
+    def values(self, name):
+        """  Returns {labels : value} for every metric called name.
+        """
+        return {labels: metric.value for (n, labels), metric in list(self.metrics.items()) if n == name}
+
+    def toDict(self):
+        result = {}
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda item: item[0]):
+            entry = {"labels": dict(labels)}
+            if metric.kind == "histogram":
+                entry.update(buckets=metric.buckets, counts=metric.counts, sum=metric.sum, count=metric.count)
+            else:
+                entry["value"] = metric.value
+            result.setdefault(name, {"type": metric.kind, "help": self.helps[name], "metrics": []})["metrics"].append(entry)
+        return result
+
+    def toPrometheus(self):
+        """  Returns the metrics in the Prometheus text format.
+        """
+        lines = []
+        names = set()
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda item: item[0]):
+            full   = f"{self.prefix}_{name}"
+            labels = tuple(self.labels.items()) + labels
+            if name not in names:
+                names.add(name)
+                lines.append(f"# HELP {full} {self.helps[name]}")
+                lines.append(f"# TYPE {full} {metric.kind}")
+
+            if metric.kind != "histogram":
+                lines.append(f"{full}{_labels(labels)} {metric.value}")
+                continue
+
+            total = 0
+            for bound, count in zip(metric.buckets + ["+Inf"], metric.counts):
+                total += count
+                lines.append(f"{full}_bucket{_labels(labels + (('le', str(bound)),))} {total}")
+            lines.append(f"{full}_sum{_labels(labels)} {metric.sum}")
+            lines.append(f"{full}_count{_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, fileName):
+        """  Writes the metrics, as a Prometheus textfile if fileName ends in .prom, otherwise as JSON.
+             Written to a temporary file and renamed, so a collector never reads half a file.
+        """
+        fileName = os.fspath(fileName)
+        text     = self.toPrometheus() if fileName.endswith(".prom") else json.dumps(self.toDict(), indent=2)
+        tmpName  = f"{fileName}.{os.getpid()}.tmp"
+        with open(tmpName, "w") as f:
+            f.write(text)
+        os.replace(tmpName, fileName)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def peakRSS():
+    """  Returns the peak resident memory of this process in bytes, or 0 if not known.
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024                # Linux gives KB, macOS bytes.
+
+
+class Profiler():
+    """  Runs cProfile on the calling thread and on every thread started after start().
+         At stop the profiles of all the threads are added together and written, for pstats or snakeviz.
+    """
+
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.profiles = []
+
+    def start(self):
+        threading.setprofile(self._startThread)
+        self._startThread()
+
+    def _startThread(self, *args):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()                        # Replaces this hook, for this thread.
+        except ValueError:                          # Python 3.12 on, the first profile covers every thread.
+            sys.setprofile(None)
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def stop(self, fileName):
+        threading.setprofile(None)
+        self.profiles[0].disable()                  # The other threads have finished.
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(fileName)
+        return stats
+
+
+def startMemoryTrace():
+    tracemalloc.start()
+
+
+def stopMemoryTrace(top=20):
+    """  Stops tracing memory, returns the peak traced memory in bytes and the top lines by memory still held.
+    """
+    snapshot = tracemalloc.take_snapshot()
+    _, peak  = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+
+
+METRICS = Metrics()
@@ -0,0 +1,179 @@
+###############################################################################################################
+#                                                                                                             #
+#  Move / rename detection.                                                                                   #
+#                                                                                                             #
+#  A file, or directory, renamed in the source would be copied under its new name and then the old copy     #
+#  deleted from the destination.  Instead the files to be deleted are matched against the files to be         #
+#  copied on (name, size, mtime) [in checksum mode also on (size, mtime), with the hash], and matches are     #
+#  renamed in the destination.                                                                                #
+#  If every file under a directory has moved to the same new directory, the directory is renamed in one go.  #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        actions = myMove.findMoves(actions, hashCache, pool, counts)
+
+    Returns the list of actions with matched copy and delete pairs replaced by a MOVE action, and
+    whole directories replaced by a DIRMOVE action.
+    A MOVE is from action.movedFrom [in the destination] to action.destPath, a DIRMOVE keeps the
+    MOVE actions it replaced in action.moves, so they can be done one by one if the rename fails.
+
+    counts is directory : number of actions under it, for actions already done and not in the list,
+    kept up to date with myMove.countDirs(path, counts).  A directory with other actions in it is not
+    moved in one go.
+"""
+
+import os
+import myDiff
+import myHash
+
+
+def findMoves(actions, hashCache=None, pool=None, counts=None):
+    """  Matches files to be deleted from the destination against files to be copied.
+
+         Files are matched on (name, size, mtime), only if there is exactly one candidate on each side.
+         If a myHash.HashCache is given [checksum mode], a match is only taken if the contents are the same -
+         hashed through the cache, the rest on pool [or a pool started for the call], so the compare stage is
+         not held up hashing one file at a time.  Only then are renamed files matched too, on (size, mtime) -
+         without the contents, an unrelated file of the same size and date would be taken for a move.
+    """
+    copies  = [a for a in actions if a.mode == myDiff.COPY]
+    deletes = [a for a in actions if a.mode == myDiff.DELETE]
+    moves   = []
+    oldSource = {}                                  # old destination path : the source path it mirrored.
+
+    keys = [lambda a: (os.path.basename(a.destPath), a.size, a.mtime)]
+    if hashCache is not None:
+        keys.append(lambda a: (a.size, a.mtime))
+
+    for keyOf in keys:
+        if not copies or not deletes:
+            break
+
+        deleteIndex = _uniqueIndex(deletes, keyOf)
+        pairs       = [(copy, deleteIndex[key]) for key, copy in _uniqueIndex(copies, keyOf).items() if key in deleteIndex]
+        if hashCache is not None and pairs:
+            pairs = _sameContents(pairs, hashCache, pool)
+
+        for copy, delete in pairs:
+            move           = myDiff.Action(myDiff.MOVE, copy.sourcePath, copy.destPath, copy.size, copy.mtime)
+            move.movedFrom = delete.destPath
+            moves.append(move)
+            oldSource[delete.destPath] = delete.sourcePath
+
+        movedTo = {m.destPath for m in moves}
+        copies  = [a for a in copies if a.destPath not in movedTo]
+        deletes = [a for a in deletes if a.destPath not in oldSource]
+
+    if not moves:
+        return actions
+
+    movedTo = {m.destPath for m in moves}
+    others  = [a for a in actions
+               if not (a.mode == myDiff.COPY and a.destPath in movedTo)
+               and not (a.mode == myDiff.DELETE and a.destPath in oldSource)]
+
+    return findDirMoves(moves, others, oldSource, counts) + others
+
+
+def countDirs(path, counts):
+    """  Adds one to the count of every directory above path.
+    """
+    dir = os.path.dirname(path)
+    while True:
+        counts[dir] = counts.get(dir, 0) + 1
+        up = os.path.dirname(dir)
+        if up == dir:
+            break
+        dir = up
+
+
+def findDirMoves(moves, others, oldSource, counts=None):
+    """  Groups the file moves by the old and new directories, once the common tail of the paths is removed.
+
+         If the old directory is not in the source, the new directory is not in the destination, and no
+         other action is in either, the group is replaced by one DIRMOVE of the old directory.
+    """
+    groups = {}                                     # (old, new) : [(move, depth)]
+    for move in moves:
+        old, new, depth = _stripCommonTail(move.movedFrom, move.destPath)
+        groups.setdefault((old, new), []).append((move, depth))
+
+    counts = dict(counts or {})                     # directory : number of actions under it.
+    for path in [a.destPath for a in others] + [m.movedFrom for m in moves] + [m.destPath for m in moves]:
+        countDirs(path, counts)
+
+    result = []
+    for (old, new), group in groups.items():
+        first, depth = group[0]
+        files        = [move for move, _ in group]
+
+        if (depth == 0                              # The file itself has been renamed.
+                or counts.get(old) != len(group) or counts.get(new) != len(group)
+                or os.path.exists(new) or os.path.exists(_up(oldSource[first.movedFrom], depth))):
+            result.extend(files)                    # Not a whole directory, move the files one by one.
+            continue
+
+        dirMove           = myDiff.Action(myDiff.DIRMOVE, _up(first.sourcePath, depth), new, sum(m.size for m in files))
+        dirMove.movedFrom = old
+        dirMove.moves     = files
+        result.append(dirMove)
+
+    return result
+
+
+def _uniqueIndex(actions, keyOf):
+    """  Returns key : action, for the keys that only one action has.
+    """
+    index = {}
+    for action in actions:
+        key = keyOf(action)
+        index[key] = None if key in index else action
+    return {k: a for k, a in index.items() if a is not None}
+
+
+def _sameContents(pairs, hashCache, pool=None):
+    """  Returns the (copy, delete) pairs whose files have the same contents.
+         All are hashed in one go, through the cache and on the pool of hashing processes.
+    """
+    hashes, _ = myHash.hashFiles([path for copy, delete in pairs for path in (copy.sourcePath, delete.destPath)],
+                                 hashCache, pool=pool)
+    return [(copy, delete) for copy, delete in pairs
+            if hashes.get(copy.sourcePath) is not None and hashes.get(copy.sourcePath) == hashes.get(delete.destPath)]
+
+
+def _stripCommonTail(old, new):
+    """  Removes the path components the two paths end with.
+         Returns the two paths left and the number of components removed.
+    """
+    oldParts = old.split(os.sep)
+    newParts = new.split(os.sep)
+    depth    = 0
+    while len(oldParts) > 1 and len(newParts) > 1 and oldParts[-1] == newParts[-1]:
+        oldParts.pop()
+        newParts.pop()
+        depth += 1
+    return os.sep.join(oldParts), os.sep.join(newParts), depth
+
+
+def _up(path, levels):
+    for _ in range(levels):
+        path = os.path.dirname(path)
+    return path
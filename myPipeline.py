@@ -0,0 +1,188 @@
+###############################################################################################################
+#                                                                                                             #
+#  The pipeline - the scan, compare, copy and delete stages run alongside each other, joined by queues.      #
+#                                                                                                             #
+#  Each queue holds a limited number of items, a stage that gets ahead is held up until the next stage       #
+#  catches up [back-pressure], so memory stays flat however large the tree.  Each stage keeps a timer of     #
+#  how long it was busy and how long it was idle, waiting on the stages either side.                         #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        stop     = threading.Event()
+        stage    = myPipeline.Stage("Compare", compare, stop, maxQueued=10000, onClose=finish)
+        producer = myPipeline.Producer("Scan", actions, stage, stop)
+        producer.join()                     # waits for the scan to finish.
+        stage.close()                       # waits for the stage to work through its queue, then runs onClose.
+
+    stop.set() cancels the pipeline, the producer stops and the stage drops what is left in its queue.
+    Any unexpected exception in a stage also cancels the pipeline, and is left in stage.error.
+"""
+
+import time
+import queue
+import threading
+import contextlib
+
+_STOP = object()
+
+
+class StageTimer():
+    """  Times a stage, busy is the time spent working summed over the stage's threads,
+         idle is the rest of the time the threads were running.
+    """
+
+    def __init__(self, name, threads=1):
+        self.name      = name
+        self.threads   = threads
+        self.lock      = threading.Lock()
+        self.busy      = 0.0
+        self.startTime = None
+        self.endTime   = None
+
+    def start(self):
+        if self.startTime is None:
+            self.startTime = time.perf_counter()
+
+    def stop(self):
+        self.endTime = time.perf_counter()
+
+    @contextlib.contextmanager
+    def timed(self):
+        """  Counts the time spent in the with block as busy, can be used from several threads.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.busy += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def waiting(self):
+        """  Inside a timed block, counts the time spent in the with block as idle - waiting on the next stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.busy -= time.perf_counter() - start
+
+    @property
+    def elapsed(self):
+        if self.startTime is None:
+            return 0.0
+        return (self.endTime or time.perf_counter()) - self.startTime
+
+    @property
+    def idle(self):
+        return max(self.elapsed * self.threads - self.busy, 0.0)
+
+
+class Stage():
+    """  Runs fn(item) on its own thread for each item put on the stage, in order.
+
+         The queue holds at most maxQueued items, put waits while it is full.  Once closed, and the queue
+         is empty, onClose() is run on the stage's thread - unless the pipeline has been cancelled.
+         A timer can be passed in, so fn can use timer.waiting().
+    """
+
+    def __init__(self, name, fn, stop, maxQueued=10000, onClose=None, timer=None):
+        self.fn      = fn
+        self.stop    = stop
+        self.onClose = onClose
+        self.queue   = queue.Queue(maxQueued)
+        self.timer   = timer or StageTimer(name)
+        self.error   = None
+        self.thread  = threading.Thread(target=self._run, name=name, daemon=True)
+        self.timer.start()
+        self.thread.start()
+
+    def put(self, item):
+        """  Queues an item, waiting while the queue is full.
+             Returns false if the pipeline has been cancelled, and the item was not queued.
+        """
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        """  Waits for the stage to finish its queue and run onClose.
+        """
+        self.put(_STOP)
+        self.thread.join()
+
+    def _run(self):
+        try:
+            while not self.stop.is_set():
+                try:
+                    item = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _STOP:
+                    if self.onClose:
+                        with self.timer.timed():
+                            self.onClose()
+                    break
+                with self.timer.timed():
+                    self.fn(item)
+        except Exception as error:
+            self.error = error
+            self.stop.set()
+        finally:
+            self.timer.stop()
+
+
+class Producer():
+    """  Iterates over items on its own thread, putting each one on the next stage.
+         The time spent getting the next item is busy, the time waiting for the next stage is idle.
+    """
+
+    def __init__(self, name, items, stage, stop):
+        self.items  = items
+        self.stage  = stage
+        self.stop   = stop
+        self.timer  = StageTimer(name)
+        self.error  = None
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.timer.start()
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def _run(self):
+        items = iter(self.items)
+        try:
+            while not self.stop.is_set():
+                with self.timer.timed():
+                    item = next(items, _STOP)
+                if item is _STOP or not self.stage.put(item):
+                    break
+        except Exception as error:
+            self.error = error
+            self.stop.set()
+        finally:
+            self.timer.stop()
@@ -0,0 +1,168 @@
+###############################################################################################################
+#                                                                                                             #
+#  Plan - the actions of a test run written to a file, so they can be looked over and applied later.          #
+#                                                                                                             #
+#  --plan writes each copy, move and delete a test run finds, with the size and date that justified it, as   #
+#  it is found.  --apply reads the plan back and does the actions, without scanning either tree again - each #
+#  is checked with a single stat first, an action whose file has changed since is left out.                 #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        plan = myPlan.PlanWriter(fileName, sourceDir, destDir, mirrorRoot, filterKey)
+        plan.add(action)                    # as each action is found.
+        plan.close(complete)                # the plan only replaces fileName if complete.
+
+        header = myPlan.readHeader(fileName)
+        for action in myPlan.readPlan(fileName, header):
+            if myPlan.isCurrent(action):
+                ....
+
+    The plan is one JSON list per line, gzipped if fileName ends .gz.  The first line is the header :
+        ["pyBackup plan", 1, sourceDir, destDir, mirrorRoot, filterKey, time]
+    then one line per action, the paths relative to the source and mirror root :
+        [code, path, size, mtime, destPath, movedFrom, moves]
+    destPath is null if the same as path, movedFrom and moves are only there for moves.
+"""
+
+import os
+import gzip
+import json
+import time
+import myDiff
+
+MAGIC   = "pyBackup plan"
+VERSION = 1
+
+# One letter for each kind of action, keeps the plan small.
+CODES = {myDiff.COPY: "c", myDiff.SIZE: "s", myDiff.DATE: "d", myDiff.HASH: "h", myDiff.MOVE: "m",
+         myDiff.DIRMOVE: "M", myDiff.DELETE: "x", myDiff.EMPTYDIR: "e"}
+MODES = {code: mode for mode, code in CODES.items()}
+
+
+def _open(fileName, mode):
+    fileName = os.fspath(fileName)
+    if fileName.endswith(".gz"):
+        return gzip.open(fileName, mode + "t", encoding="utf-8")
+    return open(fileName, mode, encoding="utf-8")
+
+
+class Header():
+    """  The first line of a plan, what it was made from.
+    """
+
+    def __init__(self, record):
+        if not isinstance(record, list) or record[:2] != [MAGIC, VERSION]:
+            raise ValueError("not a pyBackup plan, or made by another version")
+        self.sourceDir, self.destDir, self.mirrorRoot, self.filterKey, self.time = record[2:7]
+
+
+def readHeader(fileName):
+    """  Returns the Header of a plan.  Raises OSError if it can not be read, ValueError if not a plan.
+    """
+    with _open(fileName, "r") as f:
+        return Header(json.loads(f.readline()))
+
+
+class PlanWriter():
+    """  Writes the actions of a test run to fileName, as they are found.
+         Written to a temporary file, that only replaces fileName once the plan is complete.
+    """
+
+    def __init__(self, fileName, sourceDir, destDir, mirrorRoot, filterKey=""):
+        self.fileName   = os.fspath(fileName)
+        self.tmpName    = f"{self.fileName}.{os.getpid()}.tmp{'.gz' if self.fileName.endswith('.gz') else ''}"
+        self.sourceDir  = os.fspath(sourceDir)
+        self.mirrorRoot = os.fspath(mirrorRoot)
+        self.count      = 0
+        self.file       = _open(self.tmpName, "w")
+        self._write([MAGIC, VERSION, self.sourceDir, os.fspath(destDir), self.mirrorRoot, filterKey, time.time()])
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _relative(self, path, root):
+        return path[len(root) + 1:] if path != root else ""
+
+    def _record(self, action):
+        path = self._relative(action.sourcePath, self.sourceDir)
+        dest = self._relative(action.destPath, self.mirrorRoot)
+        record = [CODES[action.mode], path, action.size, action.mtime, dest if dest != path else None]
+        if action.movedFrom is not None:
+            record.append(self._relative(action.movedFrom, self.mirrorRoot))
+            if action.moves:
+                record.append([self._record(move) for move in action.moves])
+        return record
+
+    def add(self, action):
+        """  Adds an action to the plan, called from the compare stage only.
+        """
+        self._write(self._record(action))
+        self.count += 1
+
+    def close(self, complete=True):
+        """  Closes the plan, if complete it replaces fileName, otherwise it is thrown away.
+        """
+        self.file.close()
+        if complete:
+            os.replace(self.tmpName, self.fileName)
+        else:
+            os.remove(self.tmpName)
+
+
+def readPlan(fileName, header):
+    """  Yields the actions in a plan, one at a time, so a plan of any size can be applied.
+    """
+    with _open(fileName, "r") as f:
+        f.readline()                                # The header.
+        for line in f:
+            yield _action(json.loads(line), header)
+
+
+def _action(record, header):
+    code, path, size, mtime, dest = record[:5]
+    action = myDiff.Action(MODES[code], os.path.join(header.sourceDir, path),
+                           os.path.join(header.mirrorRoot, path if dest is None else dest), size, mtime)
+    if len(record) > 5:
+        action.movedFrom = os.path.join(header.mirrorRoot, record[5])
+    if len(record) > 6:
+        action.moves = [_action(move, header) for move in record[6]]
+    return action
+
+
+def isCurrent(action):
+    """  Returns true if the file that justified action is as it was when the plan was made, checked with one stat.
+
+         A copy checks the source file, a delete or a file move the destination file, they must have the same
+         size and date.  A directory move only checks the directory is still there.  An empty directory is always
+         current, it is only removed if still empty, and may have been moved away by a directory move.
+    """
+    if action.mode == myDiff.EMPTYDIR:
+        return True
+    try:
+        if action.mode in myDiff.FORWARD:
+            st = os.stat(action.sourcePath)
+        elif action.mode == myDiff.DIRMOVE:
+            return os.path.isdir(action.movedFrom)
+        else:
+            st = os.stat(action.movedFrom or action.destPath)
+    except OSError:
+        return False
+    return st.st_size == action.size and st.st_mtime == action.mtime
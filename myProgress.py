@@ -0,0 +1,95 @@
+###############################################################################################################
+#                                                                                                             #
+#  A progress line - one line of status, rewritten in place a couple of times a second.                      #
+#                                                                                                             #
+#  Printing a line for every file is measurable on a run of a million files, this replaces them with one     #
+#  line that is only redrawn every so often, however fast the files go by.                                   #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        progress = myProgress.Progress(status, printLock)
+        progress.start()
+        ....
+        with printLock:
+            progress.clear()                # before printing anything else.
+            print(text)
+        ....
+        progress.stop()                     # leaves the last status on the screen.
+
+    status(elapsed) is called on the progress thread and returns the line to show.
+"""
+
+import sys
+import time
+import shutil
+import threading
+
+
+class Progress():
+    """  Shows status(elapsed) on one line, redrawn in place every interval seconds.
+         If the output is not a terminal [redirected to a file] a new line is written every logInterval
+         seconds instead.
+    """
+
+    def __init__(self, status, lock, interval=0.5, logInterval=30, stream=None):
+        self.status    = status
+        self.lock      = lock
+        self.stream    = stream or sys.stdout
+        self.isTTY     = self.stream.isatty()
+        self.interval  = interval if self.isTTY else logInterval
+        self.shown     = 0                          # Length of the line on the screen, 0 if none.
+        self.stopped   = threading.Event()
+        self.startTime = time.perf_counter()
+        self.thread    = threading.Thread(target=self._run, name="progress", daemon=True)
+
+    def start(self):
+        self.startTime = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        """  Stops the updates, and leaves the last status on its own line.
+        """
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            self.clear()
+            self.stream.write(self.status(time.perf_counter() - self.startTime) + "\n")
+            self.stream.flush()
+
+    def clear(self):
+        """  Removes the progress line, call holding the lock before printing anything else.
+        """
+        if self.shown:
+            self.stream.write("\r" + " " * self.shown + "\r")
+            self.shown = 0
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            text = self.status(time.perf_counter() - self.startTime)
+            with self.lock:
+                if self.isTTY:
+                    text = text[:shutil.get_terminal_size().columns - 1]
+                    self.clear()
+                    self.stream.write(text)
+                    self.shown = len(text)
+                else:
+                    self.stream.write(text + "\n")
+                self.stream.flush()
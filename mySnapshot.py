@@ -0,0 +1,149 @@
+###############################################################################################################
+#                                                                                                             #
+#  Snapshots - each run makes a new dated snapshot, rather than changing a single mirror.                     #
+#                                                                                                             #
+#  Files unchanged since the last snapshot are hard linked to it rather than copied [as rsync --link-dest],   #
+#  so a snapshot only costs the changed files, in both space and time.  Old snapshots are pruned, keeping    #
+#  the last of each day and of each week for so many days and weeks.                                         #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        snapshot = mySnapshot.Snapshot(destDir, sourceDir)
+        snapshot.begin()                    # clears up after an interrupted run, creates name.partial
+        for action in myDiff.diffTrees(sourceDir, snapshot.scanRoot, checksum=True):
+            ....                            # copy changed files, link unchanged ones, to snapshot.target(path)
+        snapshot.finish()                   # name.partial -> name, it is now the latest snapshot.
+        snapshot.prune(keepDaily=7, keepWeekly=4, remove=shutil.rmtree)
+
+    The snapshots are held in destDir as YYYY-MM-DD_HHMMSS, each holds the mirror of the source as a
+    normal run would, i.e. destDir/2020-11-20_010000/home/kevin/Documents.
+"""
+
+import os
+import errno
+import shutil
+import datetime
+import myDiff
+import myCopy
+
+SNAPSHOT_FORMAT = "%Y-%m-%d_%H%M%S"
+PARTIAL         = ".partial"                    # A snapshot being made, renamed once complete.
+PRUNE           = ".prune"                      # A snapshot being pruned, renamed first so it is never half there.
+
+
+def snapshots(destDir):
+    """  Returns the complete snapshots in destDir, as a sorted list of (time, name).
+    """
+    result = []
+    try:
+        names = os.listdir(destDir)
+    except FileNotFoundError:
+        return result
+
+    for name in names:
+        try:
+            result.append((datetime.datetime.strptime(name, SNAPSHOT_FORMAT), name))
+        except ValueError:
+            continue                                # Not a snapshot, or not complete.
+    result.sort()
+    return result
+
+
+def keep(times, keepDaily=7, keepWeekly=4):
+    """  Returns the set of times to keep, the last of each of the keepDaily most recent days that have
+         a snapshot, and the last of each of the keepWeekly most recent weeks.  The latest is always kept.
+    """
+    kept = set(times[-1:])
+    for period, number in ((lambda t: t.date(), keepDaily), (lambda t: t.isocalendar()[:2], keepWeekly)):
+        last = {}                                   # period : last time in it
+        for time in times:
+            last[period(time)] = time
+        kept.update(last[p] for p in sorted(last)[-number:] if number > 0)
+    return kept
+
+
+def linkFile(source, dest):
+    """  Hard links dest to source, if the link can not be made [too many links, or a file system without
+         hard links] the file is copied instead.  Returns "link" or the copy backend used, and the bytes written.
+    """
+    try:
+        os.link(source, dest)
+        return "link", 0
+    except OSError as error:
+        if error.errno not in (errno.EMLINK, errno.EXDEV, errno.EPERM, errno.ENOTSUP):
+            raise
+    return myCopy.copyFile(source, dest)
+
+
+class Snapshot():
+    """  A new snapshot of sourceDir in destDir, named after now.
+
+         scanRoot is the mirror of the source in the latest snapshot, what the source is compared against,
+         target() maps a path there to the same path in the new snapshot.  If there are no snapshots yet,
+         scanRoot is in the new snapshot and so is empty.
+    """
+
+    def __init__(self, destDir, sourceDir, now=None):
+        self.destDir  = os.fspath(destDir)
+        self.name     = (now or datetime.datetime.now()).strftime(SNAPSHOT_FORMAT)
+        self.path     = os.path.join(self.destDir, self.name + PARTIAL)
+        existing      = snapshots(self.destDir)
+        self.latest   = existing[-1][1] if existing else None
+        base          = os.path.join(self.destDir, self.latest) if self.latest else self.path
+        self.baseRoot = base
+        self.scanRoot = os.fspath(myDiff.mirrorRoot(sourceDir, base))
+
+    def target(self, path):
+        """  Returns the path in the new snapshot of path in the latest snapshot.
+        """
+        return self.path + path[len(self.baseRoot):]
+
+    def begin(self):
+        """  Removes what is left of an interrupted run, snapshots half made or half pruned, and creates the new one.
+        """
+        for name in os.listdir(self.destDir) if os.path.isdir(self.destDir) else []:
+            if name.endswith(PARTIAL) or name.endswith(PRUNE):
+                shutil.rmtree(os.path.join(self.destDir, name), ignore_errors=True)
+        os.makedirs(self.path)
+
+    def finish(self):
+        """  Marks the new snapshot as complete, it becomes the latest.
+        """
+        final = os.path.join(self.destDir, self.name)
+        os.rename(self.path, final)
+        self.path = final
+
+    def prune(self, keepDaily=7, keepWeekly=4, remove=shutil.rmtree):
+        """  Removes the snapshots not kept by the retention policy, see keep().  Each is renamed first,
+             so an interrupted prune does not leave a half removed snapshot looking complete.
+             remove(path) removes a tree, shutil.rmtree or send2trash.  Returns the names removed.
+        """
+        existing = snapshots(self.destDir)
+        kept     = keep([time for time, _ in existing], keepDaily, keepWeekly)
+        pruned   = []
+        for time, name in existing:
+            if time in kept:
+                continue
+            path = os.path.join(self.destDir, name)
+            os.rename(path, path + PRUNE)
+            remove(path + PRUNE)
+            pruned.append(name)
+        return pruned
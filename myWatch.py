@@ -0,0 +1,240 @@
+###############################################################################################################
+#                                                                                                             #
+#  Watch - follows the changes to the source tree, so only the directories that have changed are compared.   #
+#                                                                                                             #
+#  On Linux inotify is used, through ctypes, with a watch on every directory of the source.  Bursts of        #
+#  events are gathered up and handed back as one set of changed directories.  If inotify is not available,   #
+#  or runs out of watches, the whole tree is compared every so often instead [polling].  Either way, the     #
+#  whole tree is compared every now and then, in case an event was missed [the event queue overflowed].      #
+#                                                                                                             #
+#       Kevin Scott     2020                                                                                  #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        watcher = myWatch.Watcher(sourceDir, settle=2, maxDelay=30, reconcile=3600, poll=60)
+        for dirs in watcher.batches():
+            if dirs is None:
+                ....                        # compare the whole tree.
+            else:
+                ....                        # compare just these directories, not their sub directories.
+        watcher.close()
+
+    batches() runs until interrupted with Ctrl-C.
+"""
+
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import time
+
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = os.O_NONBLOCK
+IN_CLOEXEC     = 0o2000000
+
+# The changes to a directory's contents, a file is only reported once it has been written and closed.
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+_EVENT = struct.Struct("iIII")                      # wd, mask, cookie, len - then len bytes of name.
+_libc  = None
+
+
+def _inotify():
+    """  Returns libc with the inotify functions, or None if not on Linux.
+    """
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(name, use_errno=True) if name else None
+        if libc is None or not hasattr(libc, "inotify_init1"):
+            return None
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes  = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def _check(result):
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+
+class Watcher():
+    """  Watches root for changes.
+
+         settle    - a burst of events is over once there have been none for this many seconds.
+         maxDelay  - a burst is handed back after this many seconds, even if the events keep coming.
+         reconcile - the whole tree is compared this often, in seconds, 0 for never.
+         poll      - if inotify can not be used, the whole tree is compared this often, in seconds.
+         exclude   - exclude(path) returns true for a directory that is not watched, nor anything under it.
+    """
+
+    def __init__(self, root, settle=2.0, maxDelay=30.0, reconcile=3600, poll=60, exclude=None):
+        self.root      = os.fspath(root)
+        self.settle    = settle
+        self.maxDelay  = maxDelay
+        self.reconcile = reconcile
+        self.poll      = poll
+        self.exclude   = exclude
+        self.watches   = {}                         # wd : directory
+        self.fd        = None
+        self.error     = None                       # Why inotify is not used, if polling.
+        self.missed    = False                      # An event may have been missed, compare the whole tree.
+
+        libc = _inotify()
+        if libc is None:
+            self.error = "inotify not available"
+            return
+        try:
+            self.fd = _check(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+            self.addTree(self.root)
+        except OSError as error:
+            self._fallBack(error)
+
+    @property
+    def polling(self):
+        return self.fd is None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.watches = {}
+
+    def _fallBack(self, error):
+        """  inotify has failed [usually out of watches, see fs.inotify.max_user_watches], poll instead.
+        """
+        self.error  = error
+        self.missed = True
+        self.close()
+
+    def addTree(self, top):
+        """  Adds a watch to top and every directory under it.
+             A directory that has gone already is skipped, its parent's event covers it.
+        """
+        stack = [top]
+        while stack:
+            dir = stack.pop()
+            if self.exclude and self.exclude(dir):
+                continue
+            try:
+                wd = _check(_libc.inotify_add_watch(self.fd, os.fsencode(dir), WATCH_MASK))
+                self.watches[wd] = dir
+                with os.scandir(dir) as entries:
+                    stack.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+            except OSError as error:
+                if error.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    raise
+
+    def removeTree(self, top):
+        """  Removes the watches on top and every directory under it, it has been moved away.
+             Where it was moved to, if still under root, is added again by the IN_MOVED_TO.
+        """
+        prefix = top + os.sep
+        for wd, dir in list(self.watches.items()):
+            if dir == top or dir.startswith(prefix):
+                _libc.inotify_rm_watch(self.fd, wd)             # May already be gone, that's fine.
+                del self.watches[wd]
+
+    def read(self):
+        """  Reads the waiting events, returns the set of directories whose contents have changed.
+        """
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return set()
+
+        dirs   = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name    = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                self.missed = True
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            dir = self.watches.get(wd)
+            if dir is None:
+                continue
+
+            dirs.add(dir)
+            if mask & IN_ISDIR and name:
+                path = os.path.join(dir, os.fsdecode(name))
+                if mask & IN_MOVED_FROM:
+                    self.removeTree(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.addTree(path)
+                    except OSError as error:
+                        self._fallBack(error)
+                        return dirs
+        return dirs
+
+    def batches(self):
+        """  Yields the set of directories changed by each burst of events, or None when the whole tree
+             should be compared - every reconcile seconds, after the event queue overflowed, or every
+             poll seconds if polling.
+        """
+        nextReconcile = time.monotonic() + self.reconcile
+
+        while True:
+            if self.polling:
+                time.sleep(self.poll)
+                self.missed = False
+                yield None
+                continue
+
+            timeout = max(nextReconcile - time.monotonic(), 0) if self.reconcile else None
+            ready   = select.select([self.fd], [], [], timeout)[0]
+            if not ready:
+                nextReconcile = time.monotonic() + self.reconcile
+                yield None
+                continue
+
+            dirs  = set()
+            first = time.monotonic()
+            while not self.polling:
+                dirs |= self.read()
+                wait = min(self.settle, first + self.maxDelay - time.monotonic())
+                if wait <= 0 or not select.select([self.fd], [], [], wait)[0]:
+                    break
+
+            if self.missed:
+                self.missed   = False
+                nextReconcile = time.monotonic() + self.reconcile
+                yield None
+            elif dirs:
+                yield dirs
@@ -32,182 +32,759 @@
 
 import os
 import time
+import errno
+import threading
 import shutil
+import collections
+import itertools
 import pathlib
 import textwrap
 import datetime
 import argparse
 import colorama
+import myDiff
+import myCopy
+import myDelta
+import myHash
+import myMove
+import myDelete
+import myPipeline
+import myMetrics
+import myProgress
+import mySnapshot
+import myWatch
+import myFilter
+import myJobs
+import myJournal
+import myPlan
+import myManifest
 import myConfig
 import myLogger
 from send2trash import send2trash
 from myLicense import printLongLicense, printShortLicense
+from myMetrics import METRICS
 
 
-class Results:
-    """  A simple class that holds the total number and size of files copied.
-         Save on global variables.
+# The name each kind of action is counted under, in the metrics.
+MODE_NAMES = {myDiff.COPY: "new", myDiff.SIZE: "size", myDiff.DATE: "date", myDiff.HASH: "hash",
+              myDiff.MOVE: "moved", myDiff.DIRMOVE: "moved", myDiff.DELETE: "deleted", myDiff.LINK: "linked"}
+
+
+def updateResults(mode, size, number=1, backend=None, written=0, seconds=None):
+    """  Records number files of size bytes in total done, in the metrics.
+         Called from the copy and delete threads, the metrics are thread safe.
+    """
+    METRICS.counter("files_total", "Files done, by what was done to them.", mode=MODE_NAMES[mode]).inc(number)
+    METRICS.counter("bytes_total", "Bytes in the files done, by what was done to them.", mode=MODE_NAMES[mode]).inc(size)
+
+    if backend is None:
+        return
+
+    METRICS.counter("copy_backend_total", "Files copied, by the backend that copied them.", backend=backend).inc()
+    METRICS.counter("written_bytes_total", "Bytes actually written, less than copied if delta, sparse copies or hard links are used.").inc(written)
+    METRICS.histogram("file_size_bytes", "Size of the files copied.", myMetrics.SIZE_BUCKETS).observe(size)
+    if seconds is not None:
+        METRICS.histogram("copy_seconds", "Time to copy a file.").observe(seconds)
+    if backend == "delta":
+        METRICS.counter("delta_files_total", "Files delta copied.").inc()
+        METRICS.counter("delta_bytes_total", "Bytes in the files delta copied.").inc(size)
+        METRICS.counter("delta_written_bytes_total", "Bytes written by the delta copies.").inc(written)
+
+
+def countError(kind):
+    METRICS.counter("errors_total", "Errors, by what was being done.", kind=kind).inc()
+
+
+def errorCount():
+    return sum(METRICS.values("errors_total").values())
+
+
+def report(text):
+    """  Prints a line of text, the copy threads print through here so their lines are not mixed up.
+         The progress line, if shown, is cleared first and redrawn later.
+    """
+    with PrintLock:
+        if ProgressLine:
+            ProgressLine.clear()
+        print(text)
+
+
+def detail(text):
+    """  Prints a line about a single file, only if verbose [or in test mode], otherwise the progress line covers it.
+    """
+    if Verbose:
+        report(text)
+
+
+def progressStatus(elapsed):
+    """  Returns the progress line, called by ProgressLine every half a second or so.
+         The ETA is for the files found so far, it grows while the scan is still going.
     """
-    def __init__(self):
-        self.copySize     = 0
-        self.copyNumber   = 0
-        self.sizeSize     = 0
-        self.sizeNumber   = 0
-        self.dateSize     = 0
-        self.dateNumber   = 0
-        self.deleteSize   = 0
-        self.deleteNumber = 0
-        self.emptyDirs    = 0
-
-
-def updateResults(mode, sourceFileName):
-
-    if mode == "file does not exist in destination.":
-        CopyResults.copyNumber += 1
-        CopyResults.copySize   += os.path.getsize(sourceFileName)
-    elif mode == "file size has changed.":
-        CopyResults.sizeNumber += 1
-        CopyResults.sizeSize   += os.path.getsize(sourceFileName)
-    elif mode == "file date has changed.":
-        CopyResults.dateSize += 1
-        CopyResults.dateSize   += os.path.getsize(sourceFileName)
-
-
-def copyFiles(sourceFileName, destFileName, mode, test):
+    copiedFiles = sum(METRICS.value("files_total", mode=mode) for mode in ("new", "size", "date", "hash"))
+    copiedBytes = sum(METRICS.value("bytes_total", mode=mode) for mode in ("new", "size", "date", "hash"))
+    queuedBytes = METRICS.value("queued_bytes_total")
+    bytesRate   = copiedBytes / elapsed if elapsed else 0
+    eta         = datetime.timedelta(seconds=int((queuedBytes - copiedBytes) / bytesRate)) if bytesRate else "-"
+    if isinstance(Compare, Applier):
+        found = f"{'Reading' if Scanner.thread.is_alive() else 'Read'} plan {METRICS.value('plan_actions_total')} actions"
+    else:
+        found = f"{'Scanning' if Scanner.thread.is_alive() else 'Scanned'} {METRICS.value('scanned_files_total')} files"
+
+    return (f"{found} :: "
+            f"copied {copiedFiles} of {METRICS.value('queued_files_total')}, {copiedFiles / elapsed if elapsed else 0:.0f} files/s, "
+            f"{getHumanReadable(bytesRate)}/s :: deleted {METRICS.value('files_total', mode='deleted')} :: ETA {eta}")
+
+
+def copyFiles(action, test):
     """  If file does not exist in the destination directory, then copy the file.
          If the destination path does not exit, the directory path is created.
 
          Will only copy is test is set to false.
+         Runs on one of the copy threads, unless in test mode.
     """
-    dir = destFileName.parent
+    sourceFileName = action.sourcePath
+    destFileName   = action.destPath
+    dir            = os.path.dirname(destFileName)
 
-    if not os.path.exists(dir):
-        try:
-            if not test: os.makedirs(dir)        # use instead of mkdir, will recursively create directory path.
-            print(f"Created {dir}")
-        except (IOError, os.error) as error:
-            logger.error(f"ERROR :: {dir} : does not exist, or could not be created {error}", exc_info=True)
-            print(f"ERROR :: {dir} : does not exist, or could not be created {error}")
-            return
+    try:
+        if test:
+            created = not os.path.exists(dir)
+        else:
+            created = CopyWorkers.makeDirs(dir)     # Each directory is only created once, by one thread.
+            if created:
+                DestManifest.addDir(dir)
+        if created:
+            detail(f"Created {dir}")
+    except (IOError, os.error) as error:
+        countError("mkdir")
+        logger.error(f"ERROR :: {dir} : does not exist, or could not be created {error}", exc_info=True)
+        report(f"ERROR :: {dir} : does not exist, or could not be created {error}")
+        return
+
+    try:
+        detail(f"Copying : {action.mode} :: {os.path.basename(sourceFileName)}")
+        # Copies the file metadata with the file, as copy2, using the fastest backend available.
+        # Large files that have changed only have the changed blocks written.
+        if not test:
+            start = time.perf_counter()
+            if action.mode == myDiff.LINK:
+                backend, written = mySnapshot.linkFile(sourceFileName, destFileName)
+                if backend == "link":               # Otherwise could not link, copied instead.
+                    updateResults(action.mode, action.size)
+                    return
+            elif (action.mode != myDiff.COPY and DeltaThreshold and action.size >= DeltaThreshold
+                    and os.stat(destFileName).st_nlink == 1):   # Written in place, so not if it has other hard links.
+                backend = "delta"
+                written = myDelta.deltaCopy(sourceFileName, destFileName, **DeltaOptions)
+            else:
+                if Journal is not None:
+                    Journal.started(destFileName)   # Written to a temporary file, removed next run if not completed.
+                backend, written = myCopy.copyFile(sourceFileName, destFileName, CopyWorkers.links)
+            seconds = time.perf_counter() - start
+            DestManifest.addFile(destFileName)
+            if Journal is not None:
+                Journal.done("copy", destFileName)
+            updateResults(action.mode, action.size, backend=backend, written=written, seconds=seconds)
+    except (IOError, os.error, shutil.Error) as error:
+        countError("copy")
+        logger.error(f"ERROR :: { error} : could not copy {os.path.basename(sourceFileName)}", exc_info=True)
+        report(f"ERROR :: { error} : could not copy {os.path.basename(sourceFileName)}")
+    except Exception as error:                          # Not an IO error, but the file still was not copied.
+        countError("copy")
+        logger.error(f"ERROR :: { error} : could not copy {os.path.basename(sourceFileName)}", exc_info=True)
+        report(f"ERROR :: { error} : could not copy {os.path.basename(sourceFileName)}")
+
+
+def moveFiles(action, test):
+    """  Renames a file, or a whole directory, in the destination that has been moved in the source.
+
+         Will only move if test is set to false.
+         If the rename fails, returns the copy and delete actions that the move replaced, so they can be done instead.
+    """
+    oldName = action.movedFrom
+    newName = action.destPath
+    moves   = action.moves or [action]
+    if test and Plan is not None:
+        Plan.add(action)
+
+    try:
+        detail(f"Moving : {action.mode} :: {oldName} -> {newName}")
+        if not test and Snapshot is not None:           # The old snapshot is kept, link from it instead.
+            for move in moves:
+                CopyWorkers.makeDirs(os.path.dirname(Snapshot.target(move.destPath)))
+                mySnapshot.linkFile(move.movedFrom, Snapshot.target(move.destPath))
+            updateResults(action.mode, action.size, len(moves))
+        elif not test:
+            if CopyWorkers.makeDirs(os.path.dirname(newName)):
+                DestManifest.addDir(os.path.dirname(newName))
+            os.rename(oldName, newName)
+            DestManifest.move(oldName, newName)
+            if Journal is not None:
+                Journal.record("move", newName, oldName)
+                Journal.release(itertools.chain.from_iterable((m.destPath, m.movedFrom) for m in moves))
+            updateResults(action.mode, action.size, len(moves))
+            if action.moves:
+                METRICS.counter("moved_dirs_total", "Whole directories renamed in the destination.").inc()
+        return []
+    except (IOError, os.error) as error:
+        countError("move")
+        logger.error(f"ERROR :: {error} : could not move {oldName}, will copy instead", exc_info=True)
+        report(f"ERROR :: {error} : could not move {oldName}, will copy instead")
+
+    fallback = []
+    for move in moves:
+        fallback.append(myDiff.Action(myDiff.COPY, move.sourcePath, move.destPath, move.size, move.mtime))
+        fallback.append(myDiff.Action(myDiff.DELETE, move.sourcePath, move.movedFrom, move.size, move.mtime))
+    return fallback
+
+
+def deleteFiles(actions, test, inOneGo=True):
+    """  Deletes the files that are in the destination directory and not in the source directory.
+
+         A directory tree that will be empty [an EMPTYDIR action] with files in it to delete is deleted in one go,
+         the rest of the files are deleted one by one.  The deletes are queued to the Deleter, which runs
+         in the background.
+         If inOneGo is false [--apply] no tree is deleted in one go, only the files in actions are, and the
+         directories are left to removeEmptyDir() - anything put in them since the plan was made is kept.
 
-    if sourceFileName.is_file():
-        try:
-            print(f"Copying : {mode} :: {sourceFileName.name}")
-            # Use copy2 instead of copy, copies the file metadata with the file.
-            if not test:
-                shutil.copy2(sourceFileName, destFileName)
-                updateResults(mode, sourceFileName)
-        except (IOError, os.error, shutil.Error) as error:
-            logger.error(f"ERROR :: { error} : could not copy {sourceFileName.name}", exc_info=True)
-            print(f"ERROR :: { error} : could not copy {sourceFileName.name}")
-
-
-def compareForwardFiles(sourceFileName, destFileName, test):
-    """  Called when forward checking the original source against the original destination.
-
-         Compares two files, one in the source directory and the second in the destination directory.
-         Then copies the files depending upon the result.
-         Will only copy the file if it does not exist in the destination or has been altered,
-         or that the file size is different in source and destination,
-         or that the file date is later in source then destination.
+         will only delete if test is set to false.
     """
-    if not destFileName.exists():
-        mode = "file does not exist in destination."
-        copyFiles(sourceFileName, destFileName, mode, test)
-    elif os.path.getsize(sourceFileName) != os.path.getsize(destFileName):
-        mode = "file size has changed."
-        copyFiles(sourceFileName, destFileName, mode, test)
-    elif (os.path.getmtime(sourceFileName) > os.path.getmtime(destFileName)):
-        mode = "file date has changed."
-        copyFiles(sourceFileName, destFileName, mode, test)
+    if test and Plan is not None:
+        for action in actions:
+            if action.mode in (myDiff.DELETE, myDiff.EMPTYDIR):
+                Plan.add(action)
+
+    trees = {a.destPath: (a, []) for a in actions if a.mode == myDiff.EMPTYDIR and inOneGo}
+    files = []
+
+    for action in actions:
+        if action.mode != myDiff.DELETE:
+            continue
+        dir = os.path.dirname(action.destPath)
+        while dir not in trees:
+            up = os.path.dirname(dir)
+            if up == dir:
+                files.append(action)
+                break
+            dir = up
+        else:
+            trees[dir][1].append(action)
+
+    for tree, treeFiles in trees.values():
+        if not treeFiles:
+            continue                                        # Just empty directories, left to removeEmptyDir.
+        detail(f"Deleting : directory tree not in Source :: {tree.destPath} [{len(treeFiles)} file[s]]")
+        if not test:                                        # Only remove if not running in test mode.
+            Deleter.deleteTree(tree.destPath, (tree, treeFiles))
 
+    for action in files:
+        detail(f"Deleting : {action.mode} :: {os.path.basename(action.destPath)}")
+        if not test:
+            Deleter.deleteFile(action.destPath, (action, [action]))
 
-def compareReverseFiles(sourceFileName, destFileName, test, zap):
-    """  Called when reverse checking the original destination against the original source.
+    # The trees are gone, so removeEmptyDir doesn't need to see them.
+    actions[:] = [a for a in actions if not (a.mode == myDiff.EMPTYDIR and a.destPath in trees and trees[a.destPath][1])]
 
-         Compares two files, one in the source directory and the second in the destination directory.
-         Then deletes the files if in the source directory and not in the destination.
+
+def deleted(item, error):
+    """  Called by the Deleter, on its own thread, when a file or tree has been deleted.
+    """
+    action, files = item
+
+    if error is not None:
+        countError("delete")
+        logger.error(f"ERROR :: {error} : could not delete {action.destPath}", exc_info=error)
+        report(f"ERROR :: {error} : could not delete {action.destPath}")
+        return
+
+    DestManifest.remove(action.destPath)
+    if Journal is not None:
+        Journal.record("delete", action.destPath)
+        Journal.release([action.destPath] + [f.destPath for f in files if f is not action])
+    updateResults(myDiff.DELETE, sum(f.size for f in files), len(files))
+    if action.mode == myDiff.EMPTYDIR:
+        METRICS.counter("empty_dirs_total", "Empty directories removed from the destination.").inc(action.size)
+
+
+def removeEmptyDir(actions, test, zap, planned=False):
+    """  removes the directory's in the destination that are empty once this run's files are deleted.
+
+         The scan works these out bottom up, so each action is the top of a subtree of empty directories
+         and is removed in one go - no need for several runs to remove a tree.
 
          will only delete if test is set to false.
          if zap is true the delete otherwise move to recycle bin.
+         if planned is true [--apply] the directories are only ever rmdir'ed, a plan may be applied long after it
+         was made - one that is no longer empty has changed since, it is left and counted as stale.
     """
-    if not destFileName.exists():
+    for action in actions:
+        if action.mode != myDiff.EMPTYDIR:
+            continue
+
+        f = action.destPath
+        if not test and not os.path.isdir(f):
+            if Journal is not None:
+                Journal.release([f])
+            continue                                                    # Moved away, with a directory move.
+
+        detail(f"Removing empty directory {f}")
         try:
-            if sourceFileName.is_file():
-                print(f"Deleting : file does not exist in Source :: {sourceFileName.name}")
-                if not test:                                        # Only remove if not running in test mode.
-                    CopyResults.deleteNumber += 1
-                    CopyResults.deleteSize   += os.path.getsize(sourceFileName)
-                    if zap:
-                        os.remove(sourceFileName)                   # If zap, permanently remove files
-                    else:
-                        print(f"{sourceFileName}")
-                        send2trash(str(sourceFileName))             # Otherwise move to recycle bin.
+            if not test:                                                # Only remove if not running in test mode.
+                if planned:
+                    if not removeDirs(f):
+                        METRICS.counter("plan_stale_total", "Actions in the plan left out, changed since it was made.").inc()
+                        detail(f"Changed since planned, left :: {myDiff.EMPTYDIR} :: {f}")
+                        continue
+                elif zap:
+                    for dir, _, _ in os.walk(f, topdown=False):         # If zap, permanently remove, bottom up.
+                        os.rmdir(dir)                                   # rmdir will fail if not empty, which is safe.
+                else:
+                    send2trash(f)                                       # Otherwise move to recycle bin.
+                DestManifest.remove(f)
+                if Journal is not None:
+                    Journal.done("delete", f)
+
+            METRICS.counter("empty_dirs_total", "Empty directories removed from the destination.").inc(action.size)
         except (IOError, os.error) as error:
-            logger.error(f"ERROR :: {error} : could not delete {destFileName.name}", exc_info=True)
-            print(f"ERROR :: {error} : could not delete {destFileName.name}")
+            countError("delete")
+            logger.error(f"ERROR :: {error} : could not delete {f}", exc_info=True)
+            report(f"ERROR :: {error} : could not delete {f}")
 
 
-def removeEmptyDir(destDir, zap):
-    """  removes all empty directory's in path.
+def removeDirs(top):
+    """  Removes top and the directories under it with rmdir, bottom up, those that are not empty are left.
+         Returns true if top has been removed.
+    """
+    for dir, _, _ in os.walk(top, topdown=False):
+        try:
+            os.rmdir(dir)
+        except OSError as error:
+            if error.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            continue
+        if dir != top:
+            DestManifest.remove(dir)
+    return not os.path.isdir(top)
+
+
+def newCopyWorkers(workers, timer=None):
+    """  Returns a new pool of copy threads, set up from config.toml.
+    """
+    return myCopy.CopyExecutor(workers=workers or myConfig.WORKERS(),
+                               largeWorkers=myConfig.LARGE_WORKERS(),
+                               largeFile=myConfig.LARGE_FILE(),
+                               deviceLimit=myConfig.DEVICE_LIMIT(),
+                               deviceLimits=myConfig.DEVICE_LIMITS(),
+                               timer=timer)
 
-         shutil.rmtree not deleting the whole directory tree.
-         Each run will remove the lowest level of the directory tree.  ** LOOK AT **
 
-         Only len(os.listdir(f)) gave a true zero value for empty directories.
-         Also, tried f.stat().st_size, os.stat(f)[6] & os.path.getsize(f)
+def watchSource(sourceDir, destDir, test, zap, workers, metricsFile):
+    """  Once the first backup is done, follows the changes to the source and mirrors just those, until Ctrl-C.
 
-         will only delete if test is set to false.
-         if zap is true the delete otherwise move to recycle bin.
+         Each burst of changes is compared one directory at a time, not the sub directories, against the
+         manifest.  Every so often the whole source is compared, in case a change was missed, see [WATCH]
+         in config.toml.  The copies and deletes of each burst are finished before the next is looked at.
     """
-    for f in destDir.glob("**/*"):
-        if f.is_dir():
-            if len(os.listdir(f)) == 0:
-                assert os.path.getsize != 0, f"{f} :: os.path.getsize not zero"
-                print(f"Removing empty directory {f}")
-                try:
-                    if not test:                                                # Only remove if not running in test mode.
-                        if zap:
-                            shutil.rmtree(f, ignore_errors=True, onerror=None)  # If zap, permanently remove files
-                        else:
-                            send2trash(str(f))                                  # Otherwise move to recycle bin.
-
-                    CopyResults.emptyDirs += 1
-                except (IOError, os.error) as error:
-                    logger.error(f"ERROR :: {error} : could not delete {f}", exc_info=True)
-                    print(f"ERROR :: {error} : could not delete {f}")
-
-
-def backup(sourceDir, destDir, direction, test, zap):
-    """  Performs a file walk of the source directory, then passes each filemyNAME for further processing.
+    global CopyWorkers, Deleter, DestManifest
+
+    watcher = myWatch.Watcher(sourceDir, myConfig.WATCH_SETTLE(), myConfig.WATCH_MAX_DELAY(),
+                              myConfig.WATCH_RECONCILE(), myConfig.WATCH_POLL(), Filter.excludedDir if Filter else None)
+    if watcher.polling:
+        logger.warning(f"Watching {sourceDir} by polling every {watcher.poll}s, {watcher.error}")
+        report(f"{colorama.Fore.RED}Watching {sourceDir} by polling every {watcher.poll}s, {watcher.error} {colorama.Fore.RESET}")
+    else:
+        logger.info(f"Watching {sourceDir} [{len(watcher.watches)} directories], Ctrl-C to stop")
+        report(f"Watching {sourceDir} [{len(watcher.watches)} directories], Ctrl-C to stop")
+
+    DestManifest = myManifest.Manifest(destDir, myDiff.mirrorRoot(sourceDir, destDir), readOnly=test,
+                                       filterKey=Filter.key if Filter else "")
+    CopyWorkers  = Deleter = None
+    sourceDir    = os.fspath(sourceDir)
+    inBurst      = False
+    try:
+        for dirs in watcher.batches():
+            inBurst = True
+            DestManifest.begin(dirs is None)
+            if DestManifest.rebuild and not test:
+                dirs = None                                     # The manifest was not clean, its rows have gone.
+
+            if dirs is None:
+                scan = myDiff.diffTrees(sourceDir, DestManifest.mirrorRoot, DestManifest.listDir, filter=Filter)
+            else:
+                dirs = sorted(d for d in dirs if os.path.isdir(d))  # One that has gone is deleted from its parent.
+                scan = itertools.chain.from_iterable(
+                    myDiff.diffTrees(d, DestManifest.mirrorRoot + d[len(sourceDir):], DestManifest.listDir, recursive=False, filter=Filter)
+                    for d in dirs)
+
+            before = {name: sum(METRICS.values(name).values()) for name in ("files_total", "errors_total")}
+            errors = syncChanges(scan, test, zap, workers)
+            DestManifest.commit(clean=(errors == 0))
+            inBurst = False
+            done = {name: sum(METRICS.values(name).values()) - before[name] for name in before}
+
+            what = "whole source compared" if dirs is None else f"{len(dirs)} director{'y' if len(dirs) == 1 else 'ies'} changed"
+            logger.info(f"Watch :: {what}, {done['files_total']} file[s] done, {done['errors_total']} error[s]")
+            report(f"{datetime.datetime.now():%H:%M:%S} :: {what}, {done['files_total']} file[s] done, {done['errors_total']} error[s]")
+            if metricsFile:
+                METRICS.write(metricsFile)
+    except KeyboardInterrupt:                                   # If part way through a burst, the manifest
+        if CopyWorkers:                                         # is left not clean, so is rebuilt next run.
+            CopyWorkers.cancel()
+            CopyWorkers.shutdown()
+        if Deleter:
+            Deleter.cancel()
+            Deleter.close()
+    finally:
+        watcher.close()
+        DestManifest.close()
+
+    logger.info(f"Stopped watching {sourceDir}")
+    print(f"Stopped watching {sourceDir}")
+    return inBurst
+
+
+def syncChanges(scan, test, zap, workers):
+    """  Mirrors the actions from one scan, compared on this thread, copied and deleted in the background.
+         Returns once everything is done, with the number of directories that could not be scanned.
     """
+    global CopyWorkers, Deleter
+
+    CopyWorkers = newCopyWorkers(workers)
+    Deleter     = myDelete.DeleteQueue(zap, deleted)
+    compare     = Comparator(test, DestManifest, None, myConfig.MOVE_WINDOW(), myConfig.HASH_BATCH())
+
+    for action in scan:
+        compare(action)
+    compare.finish()
+
+    for error in CopyWorkers.shutdown():
+        countError("copy")
+        logger.error(f"ERROR :: {error} : copy thread failed")
+        report(f"{colorama.Fore.RED}ERROR :: {error} : copy thread failed {colorama.Fore.RESET}")
+    Deleter.close()
+    CopyWorkers = Deleter = None
 
-    # for sourceFileName in sourceDir.glob("**/*.*"):   # Seems to miss files with no extension.
-    for sourceFileName in sourceDir.glob("**/*"):       # Recursively find all files in sourceDir.
-        # paths
-        fn = sourceFileName.parts                       # A list of all the component parts on the sourceFilemyNAME.
+    removeEmptyDir(compare.emptyDirs, test, zap)
+    return compare.errors
+
+
+def pruneSnapshots(zap):
+    """  Removes the snapshots no longer kept, see [SNAPSHOT] in config.toml.
+         if zap is true the delete otherwise move to recycle bin.
+    """
+    try:
+        pruned = Snapshot.prune(myConfig.KEEP_DAILY(), myConfig.KEEP_WEEKLY(), shutil.rmtree if zap else send2trash)
+    except (IOError, os.error) as error:
+        countError("delete")
+        logger.error(f"ERROR :: {error} : could not prune the old snapshots", exc_info=True)
+        report(f"ERROR :: {error} : could not prune the old snapshots")
+        return
+
+    for name in pruned:
+        logger.info(f"Snapshot {name} pruned")
+        detail(f"Snapshot {name} pruned")
+    METRICS.counter("snapshots_pruned_total", "Old snapshots removed by the retention policy.").inc(len(pruned))
+
+
+class Comparator():
+    """  The compare stage of the pipeline, takes the actions from the scan as they are found and passes them on.
+
+         Changed files are passed on to be copied at once.  New files and files to delete are held back, up to
+         moveWindow of each, so they can be matched as moves once the scan has finished - when the window is
+         full the oldest are passed on.  A new file that can not be a move, no file in the destination has the
+         same size and date, is passed on at once.  In checksum mode, files that look the same are hashed
+         hashBatch at a time.
+
+         Any directory that could not be scanned is reported here, and is left alone.
+         If a journal is given, each action is planned in it as it arrives, and each directory scanned passed on.
+    """
+    def __init__(self, test, manifest, hashCache=None, moveWindow=100000, hashBatch=1000, snapshot=False, journal=None):
+        self.test       = test
+        self.snapshot   = snapshot                  # Unchanged files are passed on too, to be linked.
+        self.manifest   = manifest
+        self.journal    = journal
+        self.hashCache  = hashCache
+        self.moveWindow = moveWindow
+        self.hashBatch  = hashBatch
+        self.pool       = None                      # The hashing processes, started on the first batch.
+        self.copies     = collections.deque()
+        self.deletes    = collections.deque()
+        self.same       = []
+        self.emptyDirs  = []
+        self.counts     = {}                        # directory : number of actions passed on under it.
+        self.errors     = 0                         # directories that could not be scanned.
+        self.timer      = myPipeline.StageTimer("Compare")
+
+    def __call__(self, action):
+        if action.mode == myDiff.SCANNED:
+            self.journal.scanned(action.destPath)
+            return
+        if self.journal is not None and (action.mode != myDiff.SAME or self.hashCache is not None):
+            self.journal.plan(action.destPath)      # An ERROR is never done, so its directory is never complete.
+
+        if action.mode == myDiff.SAME:
+            if self.hashCache is not None:
+                self.same.append(action)
+                if len(self.same) >= self.hashBatch:
+                    self.verify()
+            elif self.snapshot:
+                self.passOn(action)
+        elif action.mode == myDiff.ERROR:
+            self.errors += 1
+            countError("scan")
+            logger.error(f"ERROR :: {action.error} : could not scan {action.sourcePath}")
+            report(f"{colorama.Fore.RED}ERROR :: {action.error} : could not scan {action.sourcePath} {colorama.Fore.RESET}")
+        elif action.mode == myDiff.EMPTYDIR:
+            self.emptyDirs.append(action)
+        elif action.mode == myDiff.COPY:
+            if self.moveWindow and self.manifest.hasFile(action.size, action.mtime) is not False:
+                self.hold(self.copies, action)
+            else:
+                self.passOn(action)
+        elif action.mode == myDiff.DELETE:
+            self.hold(self.deletes, action)
+        else:
+            self.passOn(action)
 
-        if ":" in fn[0]:                                # If source starts with a drive [i.e. d:\], then remove.
-            p = "\\".join(fn[1:])
-        else:                                           # No drive isa source, add full path.
-            p = "\\".join(fn)
-        destFileName  = destDir.joinpath(p)             # A complete string of the destination path.
+    def hold(self, held, action):
+        held.append(action)
+        if len(held) > self.moveWindow:
+            self.passOn(held.popleft())
 
-        if direction == "forward":
-            compareForwardFiles(sourceFileName, destFileName, test)         # original.source -> original.destination
+    def passOn(self, action):
+        myMove.countDirs(action.destPath, self.counts)
+        if self.test:
+            backup(action, self.test)
         else:
-            compareReverseFiles(sourceFileName, destFileName, test, zap)    # original.destination -> original.source
+            with self.timer.waiting():              # Will wait if the copy or delete queue is full.
+                backup(action, self.test)
+
+    def verify(self):
+        if self.pool is None:
+            self.pool = myHash.newPool(myConfig.HASH_WORKERS() or None)
+        changed = set()
+        for action in myHash.verify(self.same, self.hashCache, pool=self.pool):
+            changed.add(action.destPath)
+            self.passOn(action)
+        if self.snapshot:
+            for action in self.same:
+                if action.destPath not in changed:
+                    self.passOn(action)
+        elif self.journal is not None:
+            self.journal.release(a.destPath for a in self.same if a.destPath not in changed)
+        self.same = []
+
+    def finish(self):
+        """  Run once the scan has finished, matches the files held back as moves and passes on the rest.
+             The empty directories are left in self.emptyDirs, to be removed once everything else is done.
+        """
+        if self.same:
+            self.verify()
+
+        actions = myMove.findMoves(list(self.copies) + list(self.deletes) + self.emptyDirs,
+                                   self.hashCache, self.pool, self.counts)
+        if self.pool:
+            self.pool.shutdown()
+
+        fallback = []                               # Moves first, they are quick and free up names.
+        for action in actions:
+            if action.mode in (myDiff.MOVE, myDiff.DIRMOVE):
+                fallback.extend(moveFiles(action, self.test))
+        actions.extend(fallback)
+
+        for action in actions:
+            if action.mode in myDiff.FORWARD:
+                backup(action, self.test)
+
+        if self.snapshot:                           # Nothing is deleted, the old snapshot keeps them.
+            self.emptyDirs = []
+            return
+        deleteFiles(actions, self.test)
+        self.emptyDirs = [a for a in actions if a.mode == myDiff.EMPTYDIR]
+
+
+class Applier():
+    """  The apply stage, used in place of the compare stage by --apply.  Takes the actions read from a plan and
+         passes them on, as the compare stage would have.  Each is checked first, one that has changed since the
+         plan was made is left out, see myPlan.isCurrent().
+
+         The deletes in a row are passed on together, the files one by one.  The empty directories are left in
+         self.emptyDirs, to be removed once everything else is done, only with rmdir.
+    """
+    def __init__(self, test):
+        self.test      = test
+        self.deletes   = []                         # The deletes in a row, not yet passed on.
+        self.stale     = []                         # The deletes among them left out.
+        self.emptyDirs = []
+        self.errors    = 0                          # As the compare stage, but nothing is scanned.
+        self.timer     = myPipeline.StageTimer("Apply")
+        self.actions   = METRICS.counter("plan_actions_total", "Actions read from the plan.")
+
+    def __call__(self, action):
+        self.actions.inc()
+        current = myPlan.isCurrent(action)
+        if not current:
+            METRICS.counter("plan_stale_total", "Actions in the plan left out, changed since it was made.").inc()
+            detail(f"Changed since planned, left out :: {action.mode} :: {action.destPath}")
+
+        if action.mode in (myDiff.DELETE, myDiff.EMPTYDIR):
+            if current:
+                self.deletes.append(action)
+            else:
+                self.stale.append(action.destPath)
+            return
+
+        self.finish()
+        if not current:
+            return
+        with self.timer.waiting():                  # Will wait if the copy or delete queue is full.
+            if action.mode in (myDiff.MOVE, myDiff.DIRMOVE):
+                for fallback in moveFiles(action, self.test):
+                    backup(fallback, self.test)
+            else:
+                backup(action, self.test)
+
+    def finish(self):
+        """  Passes on the deletes held.  Only the files planned are deleted, each checked, never a whole tree in
+             one go - anything put in a directory since the plan was made is kept.  The directories are removed
+             at the end, only if empty.  A tree with a file in it that has changed since is left.
+        """
+        if self.stale:
+            self.deletes = [a for a in self.deletes
+                            if not (a.mode == myDiff.EMPTYDIR and any(p.startswith(a.destPath + os.sep) for p in self.stale))]
+        if self.deletes:
+            deleteFiles(self.deletes, self.test, inOneGo=False)
+            self.emptyDirs.extend(a for a in self.deletes if a.mode == myDiff.EMPTYDIR)
+        self.deletes = []
+        self.stale   = []
+
+
+def backup(action, test):
+    """  Passes an action on, copies go to the copy threads and deletes to the Deleter, both run in the background.
+         In test mode the copies are just reported, here.
+
+         When making a snapshot, the action's destination is moved over to the new snapshot, unchanged files
+         are linked to the latest snapshot and nothing is deleted.
+    """
+    if Snapshot is not None:
+        if action.mode == myDiff.DELETE:
+            return
+        if action.mode == myDiff.SAME:
+            action = myDiff.Action(myDiff.LINK, action.destPath, action.destPath, action.size, action.mtime)
+        action.destPath = Snapshot.target(action.destPath)
+        if action.mode == myDiff.LINK:
+            if test:
+                return                                          # Too many to list, only the changes are reported.
+            CopyWorkers.submit(action.sourcePath, action.destPath, action.size, copyFiles, action, test)
+            return
+
+    if action.mode == myDiff.DELETE:
+        deleteFiles([action], test)                             # original.destination -> original.source
+        return
+
+    METRICS.counter("queued_files_total", "Files found to copy.").inc()
+    METRICS.counter("queued_bytes_total", "Bytes in the files found to copy.").inc(action.size)
+    if test:
+        if Plan is not None:
+            Plan.add(action)
+        copyFiles(action, test)                                 # original.source -> original.destination
+    else:
+        CopyWorkers.submit(action.sourcePath, action.destPath, action.size, copyFiles, action, test)
 
 
 def printResults():
-    """  Print out the results of the backup.
+    """  Print out the results of the backup, from the metrics.
     """
+    def files(mode):
+        return METRICS.value("files_total", mode=mode)
+
+    def size(mode):
+        return getHumanReadable(METRICS.value("bytes_total", mode=mode))
+
     print()
-    print(f"Copied {CopyResults.copyNumber:6} file[s] not in destination [Copied], {getHumanReadable(CopyResults.copySize)}")
-    print(f"Copied {CopyResults.sizeNumber:6} file[s] that size has changed      , {getHumanReadable(CopyResults.sizeSize)}")
-    print(f"Copied {CopyResults.dateNumber:6} file[s] that date has changed      , {getHumanReadable(CopyResults.dateSize)}")
-    print(f"Copied {CopyResults.deleteNumber:6} file[s] not in source [deleted]  , {getHumanReadable(CopyResults.deleteSize)}")
-    print(f"Empty directories deleted                        , {CopyResults.emptyDirs}")
+    print(f"Copied {files('new'):6} file[s] not in destination [Copied], {size('new')}")
+    print(f"Copied {files('size'):6} file[s] that size has changed      , {size('size')}")
+    print(f"Copied {files('date'):6} file[s] that date has changed      , {size('date')}")
+    if files("hash"):
+        print(f"Copied {files('hash'):6} file[s] that contents have changed  , {size('hash')}")
+    print(f"Copied {files('deleted'):6} file[s] not in source [deleted]  , {size('deleted')}")
+    if files("linked"):
+        print(f"Linked {files('linked'):6} file[s] unchanged since snapshot  , {size('linked')}")
+    if METRICS.value("plan_stale_total"):
+        print(f"Left   {METRICS.value('plan_stale_total'):6} action[s] changed since planned")
+    if files("moved"):
+        print(f"Moved  {files('moved'):6} file[s] renamed in destination     , {size('moved')}")
+        print(f"Moved  {METRICS.value('moved_dirs_total'):6} whole directories")
+    print(f"Empty directories deleted                        , {METRICS.value('empty_dirs_total')}")
+    if METRICS.value("delta_files_total"):
+        copied = sum(METRICS.value("bytes_total", mode=mode) for mode in ("new", "size", "date", "hash"))
+        print(f"Delta  {METRICS.value('delta_files_total'):6} file[s] changed blocks written    , {getHumanReadable(METRICS.value('delta_written_bytes_total'))} of {getHumanReadable(METRICS.value('delta_bytes_total'))}")
+        print(f"Bytes written of bytes copied                    , {getHumanReadable(METRICS.value('written_bytes_total'))} of {getHumanReadable(copied)}")
+    backends = METRICS.values("copy_backend_total")
+    if backends:
+        backends = ", ".join(f"{dict(labels)['backend']} {number}" for labels, number in sorted(backends.items()))
+        print(f"Copy backend[s] used                             , {backends}")
+
+
+def recordRun(timers, elapsed, complete):
+    """  Records the stage times and the throughput of the run, for monitoring.
+    """
+    for timer in timers:
+        METRICS.gauge("stage_busy_seconds", "Time each stage spent working, summed over its threads.", stage=timer.name).set(timer.busy)
+        METRICS.gauge("stage_idle_seconds", "Time each stage spent waiting, summed over its threads.", stage=timer.name).set(timer.idle)
+
+    copied  = sum(METRICS.value("bytes_total", mode=mode) for mode in ("new", "size", "date", "hash"))
+    perStage = {"Scan":   METRICS.value("scanned_bytes_total"),
+                "Copy":   copied,
+                "Delete": METRICS.value("bytes_total", mode="deleted")}
+    for timer in timers:
+        if timer.name in perStage and timer.elapsed:
+            METRICS.gauge("stage_bytes_per_second", "Bytes through each stage, per second it was running.",
+                          stage=timer.name).set(perStage[timer.name] / timer.elapsed)
+
+    METRICS.gauge("duration_seconds", "Time the run took.").set(elapsed)
+    METRICS.gauge("files_per_second", "Files in the source scanned per second.").set(METRICS.value("scanned_files_total") / elapsed)
+    METRICS.gauge("bytes_per_second", "Bytes copied per second.").set(copied / elapsed)
+    METRICS.gauge("complete", "1 if the run finished, 0 if cancelled or a stage failed.").set(int(complete))
+    METRICS.gauge("last_run_timestamp_seconds", "When the run finished.").set(time.time())
+    METRICS.gauge("peak_rss_bytes", "Peak resident memory.").set(myMetrics.peakRSS())
+
+
+def runJobs(names, metricsFile):
+    """  Runs the jobs in config.toml, all of them or just those in names, then prints the combined report.
+         Each job is a pyBackup.py process of its own, the scheduler decides which run alongside each other.
+         Exits with 0 if every job finished cleanly, 6 if cancelled, otherwise 7.
+    """
+    try:
+        jobs = myJobs.loadJobs(myConfig.JOBS(), names, myConfig.WORKERS())
+    except ValueError as error:
+        logger.error(f"ERROR :: {error}")
+        print(f"{colorama.Fore.RED}ERROR :: {error} {colorama.Fore.RESET}")
+        exit(7)
+
+    ioBudget, maxJobs = myConfig.IO_BUDGET(), myConfig.MAX_JOBS()
+    logger.info(f"Running {len(jobs)} job[s], I/O budget {ioBudget} copy threads, at most {maxJobs} at once")
+    print(f"Running {len(jobs)} job[s], I/O budget {ioBudget} copy threads, at most {maxJobs} at once", flush=True)
+
+    scheduler = myJobs.Scheduler(jobs, ioBudget, maxJobs, os.fspath(metricsFile) if metricsFile else None)
+    scheduler.run()
+
+    ok = myJobs.printReport(jobs)
+    for job in jobs:
+        logger.info(f"Job {job.name} :: exit code {job.exitCode} in {datetime.timedelta(seconds = int(job.seconds))}")
+
+    if metricsFile and not os.fspath(metricsFile).endswith(".prom"):
+        try:
+            myJobs.writeReport(jobs, metricsFile)
+            logger.info(f"Combined report written to {metricsFile}")
+        except (IOError, os.error) as error:
+            logger.error(f"ERROR :: {error} : could not write the combined report to {metricsFile}")
+            print(f"{colorama.Fore.RED}ERROR :: {error} : could not write the combined report to {metricsFile} {colorama.Fore.RESET}")
+
+    logger.info(f"End of {myConfig.NAME()}, {myConfig.VERSION()}")
+    if scheduler.cancelled:
+        exit(6)
+    exit(0 if ok else 7)
 
 
 def getHumanReadable(bytes, suffix="B"):
@@ -235,6 +812,13 @@ def parseArgs():
          Exit code 3 - No destination directory supplied.
          Exit code 4 - Source and destination directors are the same.
          Exit code 5 - Source directory not found.
+         Exit code 6 - Cancelled with Ctrl-C, the copies already started are left to finish.
+         Exit code 7 - Running the jobs in config.toml, one or more of the jobs failed.
+         Exit code 8 - Watch and snapshot can not be used together.
+         Exit code 9 - The exclude file could not be read.
+         Exit code 10 - Snapshot can not be used with resume, plan or apply.
+         Exit code 11 - The plan could not be read, or written.
+         Exit code 12 - Finished, but with errors, files not copied, moved or deleted, see the log.
     """
     parser = argparse.ArgumentParser(
         prog=myConfig.NAME(),
@@ -253,6 +837,28 @@ def parseArgs():
     parser.add_argument("-d", "--destDir",   type=pathlib.Path, action="store", default=False, help="name of the Destination directory.")
     parser.add_argument("-z", "--zap",       action="store_true", help="zap files otherwise move files to Recycle Bin.")
     parser.add_argument("-t", "--test",      action="store_true", help="run a test backup, nothing is changed only reported on.")
+    parser.add_argument("-c", "--checksum",  action="store_true", help="also compare the contents of files that look the same, slow the first time.")
+    parser.add_argument("-w", "--workers",   type=int, action="store", default=0, help="number of threads copying small files [default from config.toml].")
+    parser.add_argument("-m", "--verify-manifest", dest="verifyManifest", action="store_true", help="walk the destination and rebuild the manifest, use if the destination has been changed by hand.")
+    parser.add_argument("--snapshot",        action="store_true", help="make a new dated snapshot in the destination, files unchanged since the last one are hard linked.")
+    parser.add_argument("--exclude",         action="append", default=[], metavar="PATTERN", help="leave out files and directories matching a gitignore style pattern, !PATTERN puts them back, can be given more than once.")
+    parser.add_argument("--exclude-from",    dest="excludeFrom", type=pathlib.Path, action="store", default=None, metavar="FILE", help="read the patterns to leave out from a .gitignore style file.")
+    parser.add_argument("--min-size",        dest="minSize", type=int, action="store", default=None, help="leave out files smaller than this, in bytes.")
+    parser.add_argument("--max-size",        dest="maxSize", type=int, action="store", default=None, help="leave out files larger than this, in bytes.")
+    parser.add_argument("--min-age",         dest="minAge", type=float, action="store", default=None, help="leave out files changed less than this many days ago.")
+    parser.add_argument("--max-age",         dest="maxAge", type=float, action="store", default=None, help="leave out files changed more than this many days ago.")
+    parser.add_argument("--delete-excluded", dest="deleteExcluded", action="store_true", help="delete what is left out from the destination, otherwise it is left alone.")
+    parser.add_argument("--resume",          action="store_true", help="carry on from where an interrupted run stopped, the directories it completed are not scanned again.")
+    parser.add_argument("--plan",            type=pathlib.Path, action="store", default=None, metavar="FILE", help="run a test backup and write what would be done to FILE, gzipped if it ends .gz, to be applied later.")
+    parser.add_argument("--apply",           type=pathlib.Path, action="store", default=None, metavar="FILE", help="do what the plan in FILE says, without scanning again, -s and -d are taken from the plan.")
+    parser.add_argument("--watch",           action="store_true", help="after the backup, keep watching the source and mirror each change as it happens, until Ctrl-C.")
+    parser.add_argument("--verbose",         action="store_true", help="print a line for every file, rather than a progress line.")
+    parser.add_argument("--metrics",         type=pathlib.Path, action="store", default=None, help="write the metrics to this file at the end, as a Prometheus textfile if it ends .prom, otherwise JSON.")
+    parser.add_argument("--profile",         type=pathlib.Path, action="store", default=None, help="profile the run with cProfile, on all threads, and write the stats to this file.")
+    parser.add_argument("--trace-memory",    dest="traceMemory", action="store_true", help="trace memory with tracemalloc, and log the lines holding the most.")
+    parser.add_argument("-j", "--jobs",      nargs="*", metavar="NAME", default=None, help="run the jobs in config.toml instead of -s and -d, all of them or just those named.")
+    parser.add_argument("--job",             action="store", default=None, help=argparse.SUPPRESS)     # Set by --jobs, the name of the job being run.
+    parser.add_argument("--job-report",      dest="jobReport", action="store", default=None, help=argparse.SUPPRESS)   # Set by --jobs, the metrics as JSON for the combined report.
     parser.add_argument("-l", "--license",   action="store_true", help="Print the Software License.")
     parser.add_argument("-v", "--version",   action="store_true", help="print the version of the application.")
 
@@ -268,6 +874,21 @@ def parseArgs():
 
     printShortLicense(myConfig.NAME(), myConfig.VERSION())
 
+    if args.jobs is not None:
+        return (None, None, False, False, False, 0, False, args.metrics or myConfig.METRICS_FILE(), None, False, False,
+                args.jobs, None, False, False, None, False, None, None, None, None)
+
+    header = None
+    if args.apply:
+        try:
+            header = myPlan.readHeader(args.apply)
+        except (IOError, os.error, ValueError) as error:
+            logger.error(f"Could not read the plan {args.apply} : {error}.")
+            print(f"{colorama.Fore.RED}Could not read the plan {args.apply} : {error}. {colorama.Fore.RESET}")
+            exit(11)
+        args.sourceDir = pathlib.Path(header.sourceDir)
+        args.destDir   = pathlib.Path(header.destDir)
+
     if not args.sourceDir or not args.sourceDir.exists():
         logger.error("No Source Directory Supplied.")
         print(f"{colorama.Fore.RED}No Source Directory Supplied. {colorama.Fore.RESET}")
@@ -292,27 +913,80 @@ def parseArgs():
         parser.print_help()
         exit(4)
 
+    if args.watch and args.snapshot:
+        logger.error("Watch and snapshot can not be used together.")
+        print(f"{colorama.Fore.RED}Watch and snapshot can not be used together. {colorama.Fore.RESET}")
+        parser.print_help()
+        exit(8)
+
+    if args.snapshot and (args.resume or args.plan or args.apply):
+        logger.error("Snapshot can not be used with resume, plan or apply.")
+        print(f"{colorama.Fore.RED}Snapshot can not be used with resume, plan or apply. {colorama.Fore.RESET}")
+        parser.print_help()
+        exit(10)
+
     if not os.path.isdir(args.sourceDir):
         logger.error("Source Directory not found.")
         print(f"{colorama.Fore.RED}Source Directory not found. {colorama.Fore.RESET}")
         parser.print_help()
         exit(5)
 
-    return (args.sourceDir, args.destDir, args.test, args.zap)
+    try:
+        patterns = myConfig.EXCLUDE() + (myFilter.readPatterns(args.excludeFrom) if args.excludeFrom else []) + args.exclude
+    except (IOError, os.error) as error:
+        logger.error(f"Could not read {args.excludeFrom} : {error}.")
+        print(f"{colorama.Fore.RED}Could not read {args.excludeFrom} : {error}. {colorama.Fore.RESET}")
+        exit(9)
 
+    def option(value, default):
+        return default if value is None else value
 
-CopyResults = Results()     # Creates the results class.
+    filter = myFilter.Filter(args.sourceDir, patterns,
+                             minSize=option(args.minSize, myConfig.MIN_SIZE()), maxSize=option(args.maxSize, myConfig.MAX_SIZE()),
+                             minAge=option(args.minAge, myConfig.MIN_AGE()), maxAge=option(args.maxAge, myConfig.MAX_AGE()),
+                             deleteExcluded=args.deleteExcluded or myConfig.DELETE_EXCLUDED())
+
+    return (args.sourceDir, args.destDir, args.test or bool(args.plan), args.zap, args.verifyManifest, args.workers, args.checksum,
+            args.metrics or myConfig.METRICS_FILE(), args.profile, args.traceMemory, args.verbose, None, args.job,
+            args.snapshot, args.watch, filter if filter.active else None, args.resume, args.plan, args.apply, header,
+            args.jobReport)
+
+
+PrintLock    = threading.Lock()
+ProgressLine = None         # The progress line, if not verbose.
+Snapshot     = None         # The snapshot being made, if --snapshot.
+Journal      = None         # The journal of the run, so it can be resumed.  None in test and snapshot mode.
+Plan         = None         # The plan being written, if --plan.
+Filter       = None         # What is left out of the backup, a myFilter.Filter.  None if nothing is.
+Verbose      = False        # Print a line for every file.  Set from the command line.
+
+DeltaThreshold = 0          # Changed files of at least this size are delta copied, 0 is off.  Set from config.toml.
+DeltaOptions   = {}
 
 if __name__ == "__main__":
 
     startTime = time.time()
     myConfig  = myConfig.Config()
-    logger    = myLogger.get_logger(myConfig.NAME() + ".log")   # Create the logger.
+    logger    = myLogger.get_queue_logger(myConfig.NAME() + ".log")     # Create the logger, writes on its own thread.
 
     logger.info("-"*100)
     logger.info(f"Start of {myConfig.NAME()}, {myConfig.VERSION()}")
 
-    sourceDir, destDir, test, zap = parseArgs()
+    (sourceDir, destDir, test, zap, verifyManifest, workers, checksum, metricsFile, profileFile, traceMemory, verbose,
+     jobNames, jobName, snapshot, watch, Filter, resume, planFile, applyFile, applyHeader, jobReport) = parseArgs()
+
+    if jobNames is not None:
+        runJobs(jobNames, metricsFile)
+
+    if jobName:
+        METRICS.labels = {"job": jobName}           # So the textfiles of several jobs do not clash.
+    Verbose = verbose or (test and not planFile)        # Test mode is all about the per file output, a plan has its own file.
+
+    if profileFile:
+        profiler = myMetrics.Profiler()             # Started before any threads, so they are all profiled.
+        profiler.start()
+    if traceMemory:
+        myMetrics.startMemoryTrace()
 
     if zap:
         print("============ FILES WILL BE ZAPPED =====================================")
@@ -325,44 +999,232 @@ if __name__ == "__main__":
     if destDir.parts == ():                 # if destDir is "." then dump to Current Working Directory
         destDir = pathlib.Path.cwd()
 
-    if test:
-        print(f"Forward Scan {sourceDir} -> {destDir} in test mode [no files are copied]", flush=True)
-        logger.info(f"Forward Scan {sourceDir} -> {destDir} in test mode [no files are copied]")
+    if not test:
+        os.makedirs(destDir, exist_ok=True)             # The manifest is held in the destination.
+
+    previous  = None                                    # The interrupted run, from its journal.
+    skip      = None                                    # The directories it completed, if resumed.
+    rowsKnown = True                                    # False if the manifest rows of any directory may be wrong.
+    if snapshot:
+        Snapshot = mySnapshot.Snapshot(destDir, sourceDir)
+        if not test:
+            Snapshot.begin()
+        # The latest snapshot is walked, each snapshot is a new tree so is not kept in the manifest.
+        DestManifest = myManifest.Manifest(destDir, Snapshot.scanRoot, readOnly=True)
+        DestManifest.begin(True)
+        print(f"Snapshot {sourceDir} -> {Snapshot.name} [linked to {Snapshot.latest or 'nothing, the first snapshot'}]", flush=True)
+        logger.info(f"Snapshot {sourceDir} -> {Snapshot.name} [linked to {Snapshot.latest or 'nothing, the first snapshot'}]")
+    elif applyFile:
+        # Nothing is walked, if the manifest was clean it is kept up to date with what is done, otherwise left not clean.
+        DestManifest = myManifest.Manifest(destDir, applyHeader.mirrorRoot, readOnly=test, filterKey=applyHeader.filterKey)
+        DestManifest.begin(False, keep=True)
+        rowsKnown = not DestManifest.rebuild
+        planned   = datetime.datetime.fromtimestamp(applyHeader.time)
+        print(f"Applying {applyFile} :: {sourceDir} -> {destDir} [planned {planned:%Y-%m-%d %H:%M:%S}]", flush=True)
+        logger.info(f"Applying {applyFile} :: {sourceDir} -> {destDir} [planned {planned:%Y-%m-%d %H:%M:%S}]")
     else:
-        print(f"Forward Scan {sourceDir} -> {destDir} ", flush=True)
-        logger.info(f"Forward Scan {sourceDir} -> {destDir} ")
-
-    backup(sourceDir, destDir, "forward", test, zap)
-    forwardTime = time.time()
-
-    print("-"*100)
+        DestManifest = myManifest.Manifest(destDir, myDiff.mirrorRoot(sourceDir, destDir), readOnly=test,
+                                           filterKey=Filter.key if Filter else "")
+        Journal  = myJournal.Journal(destDir, DestManifest.mirrorRoot)
+        previous = Journal.recover(removeTemps=not test)    # Removes the copies an interrupted run left part written.
+        if previous is not None and previous.mirrorRoot != DestManifest.mirrorRoot:
+            previous = None                                 # Left by a backup of another source, not resumed.
+        resumed = resume and previous is not None
+
+        if resumed:
+            # The directories completed are not scanned, the manifest keeps their rows with what was done to them.
+            keep = previous.manifestClean and not verifyManifest
+            DestManifest.begin(True, keep)
+            if keep and not test:
+                previous.replay(DestManifest)
+            skip      = previous.complete
+            rowsKnown = keep or not skip
+            print(f"Resuming {sourceDir} <-> {destDir} [{len(skip)} directories complete]", flush=True)
+            logger.info(f"Resuming {sourceDir} <-> {destDir} [{len(skip)} directories complete]")
+        else:
+            if resume:
+                print(f"Nothing to resume in {destDir}, running a full backup")
+                logger.info(f"Nothing to resume in {destDir}, running a full backup")
+            DestManifest.begin(verifyManifest)
+
+            if DestManifest.rebuild:
+                print(f"Scanning {sourceDir} <-> {destDir} [rebuilding manifest]", flush=True)
+                logger.info(f"Scanning {sourceDir} <-> {destDir} [rebuilding manifest]")
+            else:
+                print(f"Scanning {sourceDir} <-> {destDir} [using manifest]", flush=True)
+                logger.info(f"Scanning {sourceDir} <-> {destDir} [using manifest]")
+
+        if test:
+            Journal = None                              # Nothing is done, so nothing to record.
+        else:
+            Journal.begin(sourceDir, resumed, previous.manifestClean if resumed else not DestManifest.rebuild)
+
+        if planFile:
+            try:
+                Plan = myPlan.PlanWriter(planFile, sourceDir, destDir, DestManifest.mirrorRoot, Filter.key if Filter else "")
+            except (IOError, os.error) as error:
+                logger.error(f"Could not write the plan {planFile} : {error}.")
+                print(f"{colorama.Fore.RED}Could not write the plan {planFile} : {error}. {colorama.Fore.RESET}")
+                exit(11)
+            print(f"Writing the plan to {planFile}", flush=True)
+            logger.info(f"Writing the plan to {planFile}")
 
-    reverseStartTime = time.time()
     if test:
-        print(f"Reverse Scan :: {destDir} -> {sourceDir} in test mode [no files are copied]", flush=True)
+        print("Test mode [no files are copied or deleted]", flush=True)
+        logger.info("Test mode [no files are copied or deleted]")
+
+    hashCache = (myHash.HashCache(destDir, myDiff.mirrorRoot(sourceDir, destDir), myConfig.HASH_ENTRIES(), readOnly=test)
+                 if checksum and not applyFile else None)               # Keyed on the mirror, not the snapshot.
+
+    DeltaThreshold = 0 if snapshot else myConfig.DELTA_THRESHOLD()     # A delta would write into the linked file.
+    DeltaOptions   = {"blockSize": myConfig.DELTA_BLOCK_SIZE(), "appendFastPath": myConfig.DELTA_APPEND()}
+
+    # The pipeline, scan -> compare -> copy and delete, all run alongside each other.
+    # Both directories are walked once, by the scan, and copying starts with the first changed file found.
+    Stop        = threading.Event()                     # Set on Ctrl-C, cancels the pipeline.
+    CopyTimer   = myPipeline.StageTimer("Copy")
+    DeleteTimer = myPipeline.StageTimer("Delete")
+    CopyWorkers = newCopyWorkers(workers, CopyTimer)
+    Deleter     = myDelete.DeleteQueue(zap, deleted, timer=DeleteTimer)
+    if applyFile:                                       # The plan is read in place of the scan.
+        Compare = Applier(test)
+        CompareStage = myPipeline.Stage("Apply", Compare, Stop, myConfig.QUEUE_SIZE(), onClose=Compare.finish, timer=Compare.timer)
+        Scanner = myPipeline.Producer("Plan", myPlan.readPlan(applyFile, applyHeader), CompareStage, Stop)
     else:
-        print(f"Reverse Scan :: {destDir} -> {sourceDir} ", flush=True)
-
-    backup(destDir, sourceDir, "reverse", test, zap)
-    reverseTime = time.time()
-
-    # A quick check of destDir for empty directories.
+        moveWindow  = myConfig.MOVE_WINDOW() if os.path.isdir(DestManifest.mirrorRoot) else 0  # Nothing to move from.
+        Compare     = Comparator(test, DestManifest, hashCache, moveWindow, myConfig.HASH_BATCH(), snapshot, Journal)
+        CompareStage = myPipeline.Stage("Compare", Compare, Stop, myConfig.QUEUE_SIZE(), onClose=Compare.finish, timer=Compare.timer)
+        Scanner     = myPipeline.Producer("Scan", myDiff.diffTrees(sourceDir, DestManifest.mirrorRoot, DestManifest.listDir,
+                                                                   checksum=checksum or snapshot, filter=Filter,
+                                                                   marks=Journal is not None, skip=skip), CompareStage, Stop)
+
+    if not Verbose:
+        ProgressLine = myProgress.Progress(progressStatus, PrintLock)
+        ProgressLine.start()
+
+    cancelled = False
+    try:
+        Scanner.join()
+        CompareStage.close()
+        copyErrors = CopyWorkers.shutdown()             # Wait for all the copies to finish.
+        Deleter.close()                                 # Wait for all the deletes to finish.
+    except KeyboardInterrupt:
+        cancelled = True
+        logger.warning("Cancelled, waiting for the copies already started to finish.")
+        report(f"{colorama.Fore.RED}Cancelled, waiting for the copies already started to finish. {colorama.Fore.RESET}")
+        Stop.set()
+        CopyWorkers.cancel()
+        Deleter.cancel()
+        Scanner.join()
+        CompareStage.close()
+        copyErrors = CopyWorkers.shutdown()
+        Deleter.close()
+
+    if ProgressLine:
+        ProgressLine.stop()
+        ProgressLine = None
+
+    for stage in (Scanner, CompareStage):
+        if stage.error is not None:
+            logger.error(f"ERROR :: {stage.error} : {stage.timer.name} stage failed", exc_info=stage.error)
+            print(f"{colorama.Fore.RED}ERROR :: {stage.error} : {stage.timer.name} stage failed {colorama.Fore.RESET}")
+    for error in copyErrors:
+        countError("copy")
+        logger.error(f"ERROR :: {error} : copy thread failed")
+        print(f"{colorama.Fore.RED}ERROR :: {error} : copy thread failed {colorama.Fore.RESET}")
+
+    complete = not cancelled and Scanner.error is None and CompareStage.error is None
+
+    if hashCache:
+        if complete and not skip:                       # Otherwise entries not reached would be removed.
+            hashCache.commit()
+        hashCache.close()
+
+    # The empty directories in destDir were found by the scan.
     emptyDirStartTime = time.time()
-    removeEmptyDir(destDir, zap)
+    if complete:
+        detail("-"*100)
+        # A plan may be applied long after it was made, so the empty directories are only removed if still empty.
+        removeEmptyDir(Compare.emptyDirs, test, zap, planned=bool(applyFile))
     emptyDirTime = time.time()
 
-    if CopyResults.copyNumber or CopyResults.sizeNumber or CopyResults.emptyDirs or CopyResults.deleteNumber:
+    # All manifest changes are written in one go, if not complete the destination is walked next run.
+    # If resumed or applied, the rows of the directories not walked are only right if the manifest was clean to start with.
+    DestManifest.commit(clean=(complete and Compare.errors == 0 and rowsKnown))
+    DestManifest.close()
+
+    if Plan is not None:
+        Plan.close(complete)
+        if complete:
+            logger.info(f"Plan of {Plan.count} actions written to {planFile}, do it with --apply {planFile}")
+            print(f"Plan of {Plan.count} actions written to {planFile}, do it with --apply {planFile}")
+        else:
+            logger.warning(f"Plan not complete, {planFile} not written")
+            print(f"{colorama.Fore.RED}Plan not complete, {planFile} not written {colorama.Fore.RESET}")
+        Plan = None
+
+    if Journal is not None:
+        finished = complete and not errorCount()
+        Journal.close(finished)
+        Journal = None                                  # Not used by --watch.
+        if not finished:
+            logger.warning("Run not complete, run again with --resume to carry on from where it stopped")
+            print(f"{colorama.Fore.RED}Run not complete, run again with --resume to carry on from where it stopped {colorama.Fore.RESET}")
+
+    if Snapshot is not None and not test:
+        if complete:
+            Snapshot.finish()
+            pruneSnapshots(zap)
+        else:
+            logger.warning(f"Snapshot {Snapshot.name} not complete, left as {Snapshot.path} and removed next run")
+            print(f"{colorama.Fore.RED}Snapshot {Snapshot.name} not complete, left as {Snapshot.path} and removed next run {colorama.Fore.RESET}")
+
+    if METRICS.values("files_total") or METRICS.value("empty_dirs_total"):
         printResults()
 
     print()
     elapsedTimeSecs  = time.time()  - startTime
-    forwardTimeSecs  = forwardTime  - startTime
-    reverseTimeSecs  = reverseTime  - reverseStartTime
     emptyDirTimeSecs = emptyDirTime - emptyDirStartTime
     print(f"{colorama.Fore.CYAN}Completed  :: {datetime.timedelta(seconds = elapsedTimeSecs)}   {colorama.Fore.RESET}")
-    print(f"{colorama.Fore.CYAN}Forward    :: {datetime.timedelta(seconds = forwardTimeSecs)}   {colorama.Fore.RESET}")
-    print(f"{colorama.Fore.CYAN}Reverse    :: {datetime.timedelta(seconds = reverseTimeSecs)}   {colorama.Fore.RESET}")
+    for timer in (Scanner.timer, CompareStage.timer, CopyTimer, DeleteTimer):
+        print(f"{colorama.Fore.CYAN}{timer.name:10} :: busy {datetime.timedelta(seconds = timer.busy)}  idle {datetime.timedelta(seconds = timer.idle)}   {colorama.Fore.RESET}")
     print(f"{colorama.Fore.CYAN}Empty Dirs :: {datetime.timedelta(seconds = emptyDirTimeSecs)}  {colorama.Fore.RESET}")
     print()
 
-    logger.info(f"End of {myConfig.NAME()}, {myConfig.VERSION()}")
\ No newline at end of file
+    METRICS.gauge("stage_busy_seconds", "Time each stage spent working, summed over its threads.", stage="Empty Dirs").set(emptyDirTimeSecs)
+    recordRun((Scanner.timer, CompareStage.timer, CopyTimer, DeleteTimer), elapsedTimeSecs, complete)
+
+    if traceMemory:
+        peak, top = myMetrics.stopMemoryTrace()
+        METRICS.gauge("traced_memory_peak_bytes", "Peak memory traced by tracemalloc.").set(peak)
+        logger.info(f"Traced memory peak {getHumanReadable(peak)}, lines holding the most :")
+        for line in top:
+            logger.info(f"    {line}")
+        print(f"Traced memory peak {getHumanReadable(peak)}, see the log for the lines holding the most.")
+
+    if profileFile:
+        profiler.stop(profileFile).sort_stats("cumulative").print_stats(20)
+
+    if metricsFile:
+        try:
+            METRICS.write(metricsFile)
+            logger.info(f"Metrics written to {metricsFile}")
+        except (IOError, os.error) as error:
+            logger.error(f"ERROR :: {error} : could not write the metrics to {metricsFile}")
+            print(f"{colorama.Fore.RED}ERROR :: {error} : could not write the metrics to {metricsFile} {colorama.Fore.RESET}")
+
+    if jobReport:
+        try:
+            METRICS.write(jobReport)
+        except (IOError, os.error) as error:
+            logger.error(f"ERROR :: {error} : could not write the job report to {jobReport}")
+
+    if watch and not cancelled:
+        cancelled = watchSource(sourceDir, destDir, test, zap, workers, metricsFile)
+
+    logger.info(f"End of {myConfig.NAME()}, {myConfig.VERSION()}")
+
+    if cancelled:
+        exit(6)
+    if errorCount():
+        exit(12)
\ No newline at end of file
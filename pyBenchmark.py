@@ -0,0 +1,327 @@
+###############################################################################################################
+#                                                                                                             #
+#  Benchmarks pyBackup against synthetic source and destination trees.                                       #
+#                                                                                                             #
+#  Each scenario builds a reproducible tree [from a seed], backs it up into an empty destination, then       #
+#  backs it up again with nothing changed.  The overlap scenario also renames, deletes, changes and adds     #
+#  files and backs up a third time.  Files/sec, bytes/sec, syscalls and peak memory are written to JSON, so  #
+#  releases can be compared and regressions caught.                                                          #
+#                                                                                                             #
+#        usage: pyBenchmark.py [-h] [-d DIR] [-o OUTPUT] [-s SCALE] [-r SEED] [-n NAME] [-c BASELINE]         #
+#                                                                                                             #
+#       Kevin Scott     (c) 2020                                                                              #
+#                                                                                                             #
+###############################################################################################################
+#    Copyright (C) <2020>  <Kevin Scott>                                                                      #
+#                                                                                                             #
+#    This program is free software: you can redistribute it and/or modify it under the terms of the           #
+#    GNU General Public License as published by the Free Software Foundation, either myVERSION 3 of the       #
+#    License, or (at your option) any later myVERSION.                                                        #
+#                                                                                                             #
+#    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without        #
+#    even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+#    GNU General Public License for more details.                                                             #
+#                                                                                                             #
+#    You should have received a copy of the GNU General Public License along with this program.               #
+#    If not, see <http://www.gnu.org/licenses/>.                                                              #
+#                                                                                                             #
+###############################################################################################################
+
+"""
+    usage:
+        python pyBenchmark.py -d /dev/shm -o bench.json                 # run all the scenarios.
+        python pyBenchmark.py -n tiny -n wide -s 10                     # millions of tiny files.
+        python pyBenchmark.py -o new.json -c old.json                   # exit code 1 if slower than old.json.
+
+    Each backup runs in its own process, so the memory and syscall counts are for that backup alone.
+    The syscalls counted are the read and write calls, from /proc/self/io, so Linux only - the data moved by
+    copy_file_range and sendfile is not in them, compare the writeBytes against the bytes copied.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import runpy
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+
+try:
+    import resource                                 # Not on Windows.
+except ImportError:
+    resource = None
+
+HERE  = os.path.dirname(os.path.abspath(__file__))
+BLOCK = 1024 * 1024                                 # File contents are cut from one seeded random block.
+
+
+class Tree():
+    """  Builds a synthetic tree of files, all from one seeded random generator so it is the same every time.
+         Keeps a count of the files and bytes written.
+    """
+    def __init__(self, root, seed):
+        self.root  = root
+        self.rng   = random.Random(seed)
+        self.block = bytes(self.rng.getrandbits(8) for _ in range(BLOCK))
+        self.files = 0
+        self.bytes = 0
+
+    def write(self, path, size):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            left = size
+            while left:
+                start = self.rng.randrange(BLOCK)
+                chunk = self.block[start:start + left]
+                f.write(chunk)
+                left -= len(chunk)
+        self.files += 1
+        self.bytes += size
+
+    def tinySize(self):
+        return self.rng.randint(0, 4096)
+
+
+def makeTiny(tree, scale):
+    """  Lots of tiny files, 100 to a directory, two levels deep.
+    """
+    for n in range(int(100000 * scale)):
+        tree.write(os.path.join(f"d{n // 10000:03}", f"d{n // 100 % 100:02}", f"f{n:07}"), tree.tinySize())
+
+
+def makeDeep(tree, scale):
+    """  A deep, narrow tree - a few files at each level.
+    """
+    path = ""
+    for level in range(min(int(100 * scale), 500)):                 # Kept well under PATH_MAX.
+        path = os.path.join(path, f"d{level % 100:02}")
+        for n in range(10):
+            tree.write(os.path.join(path, f"f{n}"), tree.tinySize())
+
+
+def makeWide(tree, scale):
+    """  One flat directory with a lot of files in it.
+    """
+    for n in range(int(50000 * scale)):
+        tree.write(os.path.join("wide", f"f{n:07}"), tree.tinySize())
+
+
+def makeHuge(tree, scale):
+    """  A few huge files.
+    """
+    for n in range(4):
+        tree.write(f"huge{n}", int(256 * BLOCK * scale))
+
+
+def makeOverlap(tree, scale):
+    """  A mixed tree of small and medium files, changed after the first backup by mutateOverlap.
+    """
+    for n in range(int(20000 * scale)):
+        size = tree.tinySize() if n % 10 else tree.rng.randint(4096, 4 * BLOCK)
+        tree.write(os.path.join(f"d{n // 1000:03}", f"e{n // 50 % 20:02}", f"f{n:07}"), size)
+
+
+def mutateOverlap(tree):
+    """  Renames and deletes files and whole directories, changes files and adds new ones.
+         About 5% of the files are touched by each.
+    """
+    rng   = tree.rng
+    files = sorted(os.path.relpath(os.path.join(dir, name), tree.root)
+                   for dir, _, names in os.walk(tree.root) for name in names)
+    dirs  = sorted({os.path.dirname(f) for f in files})
+
+    for dir in rng.sample(dirs, 2):                                 # Whole directory renames.
+        os.rename(os.path.join(tree.root, dir), os.path.join(tree.root, dir + "_renamed"))
+    shutil.rmtree(os.path.join(tree.root, rng.choice([d for d in dirs if not d.endswith("_renamed")])),
+                  ignore_errors=True)                               # A whole directory deleted.
+
+    files = sorted(os.path.relpath(os.path.join(dir, name), tree.root)
+                   for dir, _, names in os.walk(tree.root) for name in names)
+    picks = rng.sample(files, len(files) // 5)
+    step  = len(picks) // 4
+    for f in picks[:step]:                                          # Renames.
+        os.rename(os.path.join(tree.root, f), os.path.join(tree.root, f + "_renamed"))
+    for f in picks[step:2 * step]:                                  # Deletes.
+        os.remove(os.path.join(tree.root, f))
+    for f in picks[2 * step:3 * step]:                              # Changes, appended to.
+        with open(os.path.join(tree.root, f), "ab") as fh:
+            fh.write(tree.block[:rng.randint(1, 4096)])
+    for n, f in enumerate(picks[3 * step:]):                        # New files.
+        tree.write(os.path.join(os.path.dirname(f), f"new{n:07}"), tree.tinySize())
+
+
+SCENARIOS = {"tiny": makeTiny, "deep": makeDeep, "wide": makeWide, "huge": makeHuge, "overlap": makeOverlap}
+
+
+def runOne(sourceDir, destDir, resultFile):
+    """  Runs in the child process, backs up sourceDir to destDir and writes the measurements to resultFile.
+    """
+    sys.argv = ["pyBackup.py", "-s", sourceDir, "-d", destDir, "-z"]
+    start    = time.perf_counter()
+    result   = {}
+
+    with open(os.devnull, "w") as devNull:
+        stdout, sys.stdout = sys.stdout, devNull
+        try:
+            g = runpy.run_path(os.path.join(HERE, "pyBackup.py"), run_name="__main__")
+        except SystemExit as error:
+            g = None
+            result["error"] = f"exit code {error.code}"
+        finally:
+            sys.stdout = stdout
+
+    result["seconds"] = time.perf_counter() - start
+
+    if g is not None:
+        metrics = g["METRICS"]
+        copied  = ("new", "size", "date", "hash")
+        result["copied"]      = sum(metrics.value("files_total", mode=mode) for mode in copied)
+        result["copiedBytes"] = sum(metrics.value("bytes_total", mode=mode) for mode in copied)
+        result["written"]     = metrics.value("written_bytes_total")
+        result["moved"]       = metrics.value("files_total", mode="moved")
+        result["deleted"]     = metrics.value("files_total", mode="deleted")
+        result["emptyDirs"]   = metrics.value("empty_dirs_total")
+        result["stages"]      = {dict(labels)["stage"]: {"busy": busy, "idle": metrics.value("stage_idle_seconds", **dict(labels))}
+                                 for labels, busy in metrics.values("stage_busy_seconds").items()}
+        result["metrics"]     = metrics.toDict()
+
+    result["syscalls"] = readProcIO()
+    if resource:
+        result["peakRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024     # Linux gives KB.
+        result["peakRSSChildren"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+    with open(resultFile, "w") as f:
+        json.dump(result, f)
+
+
+def readProcIO():
+    """  Returns the read and write syscall counts, and bytes, of this process - or None if not on Linux.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return {"read": int(io["syscr"]), "write": int(io["syscw"]),
+            "readBytes": int(io["rchar"]), "writeBytes": int(io["wchar"])}
+
+
+def backup(sourceDir, destDir, files, bytes):
+    """  Runs one backup in a child process, returns its measurements with the rates added.
+    """
+    resultFile = os.path.join(os.path.dirname(destDir), "result.json")
+    subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", sourceDir, destDir, resultFile],
+                   cwd=HERE, check=True)
+    with open(resultFile) as f:
+        result = json.load(f)
+    os.remove(resultFile)
+
+    result["files"]       = files
+    result["bytes"]       = bytes
+    result["filesPerSec"] = files / result["seconds"] if result["seconds"] else 0
+    result["bytesPerSec"] = result.get("copiedBytes", 0) / result["seconds"] if result["seconds"] else 0
+    return result
+
+
+def runScenario(name, baseDir, scale, seed):
+    """  Builds the scenario's tree and times the backups, initial [empty destination], noop [nothing
+         changed] and, for overlap, changes [after mutateOverlap].
+    """
+    workDir   = tempfile.mkdtemp(prefix=f"pyBenchmark-{name}-", dir=baseDir)
+    sourceDir = os.path.join(workDir, "source")
+    destDir   = os.path.join(workDir, "dest")
+    runs      = {}
+
+    try:
+        tree  = Tree(sourceDir, f"{seed}-{name}")
+        start = time.perf_counter()
+        SCENARIOS[name](tree, scale)
+        print(f"{name:8} :: {tree.files} files, {tree.bytes} bytes, built in {time.perf_counter() - start:.1f}s", flush=True)
+
+        runs["initial"] = backup(sourceDir, destDir, tree.files, tree.bytes)
+        runs["noop"]    = backup(sourceDir, destDir, tree.files, tree.bytes)
+        if name == "overlap":
+            mutateOverlap(tree)
+            runs["changes"] = backup(sourceDir, destDir, tree.files, tree.bytes)
+
+        for run, result in runs.items():
+            print(f"{name:8} :: {run:8} {result['seconds']:8.2f}s  {result['filesPerSec']:10.0f} files/s  "
+                  f"{result['bytesPerSec'] / BLOCK:8.1f} MB/s  peak RSS {result.get('peakRSS', 0) / BLOCK:6.1f} MB", flush=True)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    return runs
+
+
+def compare(results, baseline, tolerance):
+    """  Compares the files/sec of each run against the baseline, returns true if any is slower
+         by more than tolerance [a fraction].
+    """
+    regressed = False
+    for name, runs in results["scenarios"].items():
+        for run, result in runs.items():
+            old = baseline.get("scenarios", {}).get(name, {}).get(run)
+            if not old or not old.get("filesPerSec"):
+                continue
+            ratio = result["filesPerSec"] / old["filesPerSec"]
+            flag  = ""
+            if ratio < 1 - tolerance:
+                flag      = "  <-- REGRESSION"
+                regressed = True
+            print(f"{name:8} :: {run:8} {ratio:6.2f}x baseline{flag}")
+    return regressed
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks pyBackup against synthetic trees, the results are written as JSON.")
+    parser.add_argument("-d", "--dir",      default=tempfile.gettempdir(), help="where to build the trees, use a tmpfs [/dev/shm] to leave the disk out.")
+    parser.add_argument("-o", "--output",   default="pyBenchmark.json", help="the JSON file to write the results to.")
+    parser.add_argument("-s", "--scale",    type=float, default=1.0, help="multiplies the number and size of the files, 10 for millions of tiny files.")
+    parser.add_argument("-r", "--seed",     type=int, default=2020, help="the seed the trees are built from.")
+    parser.add_argument("-n", "--name",     action="append", choices=sorted(SCENARIOS), help="the scenario[s] to run, default all.")
+    parser.add_argument("-c", "--compare",  help="a JSON file from an earlier run, exit code 1 if any run is slower.")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1, help="how much slower is a regression, default 0.1 [10%%].")
+    parser.add_argument("--run-one", nargs=3, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parseArgs()
+
+    if args.run_one:
+        runOne(*args.run_one)
+        exit(0)
+
+    sys.path.insert(0, HERE)
+    import myConfig
+    config = myConfig.Config()
+
+    results = {"version":   config.VERSION(),
+               "date":      datetime.datetime.now().isoformat(timespec="seconds"),
+               "python":    platform.python_version(),
+               "platform":  platform.platform(),
+               "dir":       args.dir,
+               "scale":     args.scale,
+               "seed":      args.seed,
+               "scenarios": {}}
+
+    for name in args.name or list(SCENARIOS):
+        results["scenarios"][name] = runScenario(name, args.dir, args.scale, args.seed)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            exit(1)